@@ -3,18 +3,32 @@ import folium
 from streamlit_folium import st_folium
 from geopy.geocoders import Nominatim
 import osmnx as ox
-import geopandas as gpd
-from shapely.geometry import Point
+import numpy as np
 import pandas as pd
 import plotly.express as px
-import networkx as nx
 #import xlrd
 #from folium import GeoJson, GeoJsonTooltip
 
-import requests
-import time
 import branca.colormap as cm# 8. Create a linear color scale for grade_abs
 import textwrap
+import threading
+from collections import namedtuple
+from contextlib import nullcontext
+from functools import partial
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import osm_cache
+from instrument import Trace
+from features import feature_cache, merge_tags
+from layers import grade_layer, isochrone_layer, poi_layer
+from network import get_street_graph, get_walk_graph, graph_within, isochrones, routing_modes
+from pipeline import (LANDUSE_TAGS, accessibility, category_lookups, fetch_region, grade_summary, iso_minutes,
+                      landuse_areas, nearest_pois, poi_filter, poi_points, travel_costs)
+from tasks import TaskGraph
+
+# OSMnx's HTTP response cache goes through the managed, size-bounded store in cache/
+# (installed once per process; reruns and other sessions get the same store)
+osm_cache.install()
 
 geolocator = Nominatim(user_agent="Navigator")
 
@@ -23,51 +37,8 @@ def geocode_address(address):
     geolocator = Nominatim(user_agent="Navigator")
     return geolocator.geocode(address)
 
-@st.cache_data(show_spinner=True, show_time = True)
-def get_osm_features(lat, lon, tags, dist):
-    return ox.features_from_point((lat, lon), tags=tags, dist=dist)
-
-@st.cache_data
-def load_pie_index(sheet):
-    df = pd.read_excel("OSM features.xls", sheet_name=sheet)
-    df = df.dropna(subset=["key", "value"])
-    df["key"] = df["key"].astype(str).str.strip()
-    df["value"] = df["value"].astype(str).str.strip()
-    return df
-
-
-
-def clip_to_circle(gdf, lat, lon, radius):
-    if gdf.crs is None:
-        gdf = gdf.set_crs(4326)
-    proj_crs = gdf.estimate_utm_crs()
-    gdf_proj = gdf.to_crs(proj_crs)
-    center = Point(lon, lat)
-    circle = gpd.GeoSeries([center], crs=4326).to_crs(proj_crs).buffer(radius)
-    return gpd.clip(gdf_proj, circle).to_crs(4326)
-
-
-
-
-def melt_tags(gdf, tag_keys):
-    # keep onlt keys that exist in gdf
-    tag_keys = [k for k in tag_keys if k in gdf.columns]
-    if not tag_keys:
-        raise ValueError("None of the provided tag_keys exist in the GeoDataFrame.")
-
-    melted = (
-        gdf[tag_keys]
-        .stack()
-        .reset_index()
-        .rename(columns={"level_2": "key", 0: "value"})
-    )
-    melted = melted.merge(gdf.reset_index()[["id", "geometry"]], on="id")
-    melted = melted.drop(columns="element")
-    melted = gpd.GeoDataFrame(melted, geometry="geometry", crs=gdf.crs)
-    return melted
-
-#get pie index 
-pie_index = load_pie_index("pie_index")
+#get pie index and its (key, value) lookup for classifying melted features
+pie_index, _ = category_lookups()["pie_index"]
 
 #Create a color to category mapping
 unique_cats = pie_index["pie_cat"].unique()
@@ -77,15 +48,168 @@ color_lookup = {
     for i, cat in enumerate(sorted(unique_cats))
 }
 
+color_lookup["unmapped"] = "lightgray"
+
 color_lookup.get(pie_index['pie_cat'][1], "gray")
 
-ms_index  = load_pie_index("Multiselect")
-ms_index = ms_index[ms_index['Multiselect'].notna()]
+def landuse_pie(pie_data, height=None):
+    # donut of the area per pie category, in the shared category colors
+    fig = px.pie(
+        pie_data,
+        names="pie_cat",
+        values="total_area_m2",
+        hover_data=["values_included"],
+        color='pie_cat',
+        color_discrete_map=color_lookup,
+        hole=.5)
+    fig.update_traces(
+        textinfo="percent+label",
+        pull=[0.05]*len(pie_data),
+        hovertemplate="<b>%{label}</b><br>%{value:,.0f} m²<br>%{customdata}")
+    fig.update_layout(height=height or fig_height)
+    return fig
+
+def in_session(trace):
+    # TaskGraph wrap: a task's thread gets this script run's context, so it can update
+    # Streamlit elements (the elevation progress bar), and the task is timed as a stage
+    # and profiled along with the query
+    ctx = get_script_run_ctx()
+    def wrap(name, fn):
+        def run(*args):
+            add_script_run_ctx(threading.current_thread(), ctx)
+            with trace.stage(name), trace.thread_profile():
+                return fn(*args)
+        return run
+    return wrap
+
+def debug_panel(record, profile=None):
+    # where the seconds of the last run went, as written to the trace log (instrument.py)
+    with st.expander("Debug: stage timings and counts"):
+        st.caption(f"Total {record['total_s']:.2f} s. Stages run as tasks overlap and include their "
+                   f"sub-stages (the walk graph its download and elevation), so the times add up to more.")
+        col_timings, col_counts = st.columns(2)
+        col_timings.dataframe(pd.Series(record["timings"], name="seconds", dtype=float).sort_values(ascending=False))
+        col_counts.json(record["counts"])
+        if profile:
+            st.code(profile)
+
+# Result of a single-address query, kept in session state so reruns (widget changes, the
+# popover) show it again without recomputing. `key` holds the inputs it was computed for,
+# `layers` the map elements per stage, `notes` the (st function, text) status messages.
+Query = namedtuple("Query", ["key", "lat", "lon", "layers", "table", "pie_data", "notes", "record", "profile"])
+
+def query_key(address, radius, poi, landuse, route_mode):
+    return (address, radius, tuple(sorted(poi)), landuse, route_mode)
+
+def result_layout(poi_pending, landuse_pending):
+    # status line, map, nearest-PoI table and land-use pie of the single-address view, as placeholders
+    status = st.container()
+    col1,col2 = st.columns(2, gap="small", border=True)
+    
+    with col1:
+        # st.subheader("Map")
+        # st.write("Here you can see land use patterns, elevation profile and where your points of interest are located")
+        map_slot = st.empty()
+        
+        with st.popover("Degree reference values"):
+            st.markdown("""
+                - **0–2%**: Very flat street, easy to walk or bike  
+                - **2–5%**: Slight incline, barely noticeable  
+                - **5–8%**: Moderate slope, noticeable uphill effort  
+                - **8–12%**: Steep street, challenging for bikes or long walks  
+                - **>12%**: Very steep, strenuous; may be difficult for vehicles, bicycles, or accessibility
+                """)
+        st.header("Nearest points of interest")
+        table_slot = st.empty()
+        if poi_pending:
+            table_slot.info("Finding the nearest points of interest...")
+        else:
+            table_slot.info("No Points of interest selected.")
+    
+    with col2:
+        st.subheader("Land use distribution")
+        pie_slot = st.empty()
+        if landuse_pending:
+            pie_slot.info("Computing the land use distribution...")
+        else:
+            pie_slot.info("No landuse characteristics were obtained. If you want to see the landuse distribution, mark the checkbox")
+    return status, map_slot, table_slot, pie_slot
+
+def draw_map(slot, lat, lon, address, radius, layers):
+    # base map with the address and radius circle, plus the elements of `layers` in their order
+    m = folium.Map(location=[lat, lon], zoom_start=14)
+    # Add address marker
+    folium.Marker([lat, lon], popup=address, icon=folium.Icon(color='red', icon='home')).add_to(m)
+    folium.Circle(
+        location=[lat, lon],
+        radius=radius,  # in meters
+        color='black',       
+        fill=False,
+        weight=2.5            
+        ).add_to(m)
+    for i, element in enumerate(element for elements in layers.values() for element in elements):
+        # each under a name of its own: st_folium renumbers the elements it renders, so an
+        # element drawn on an earlier map could otherwise take the place of another one
+        m.add_child(element, name=f"layer_{i}")
+    if any(layers.values()):
+        folium.LayerControl().add_to(m)
+    # nothing is returned to Python, so panning and zooming do not rerun the script
+    with slot:
+        st_folium(m, use_container_width=True, returned_objects=[])
+
+def show_query(query):
+    # the single-address view drawn again from a stored Query
+    st.write(f"Coordinates: {query.lat}, {query.lon}")
+    status, map_slot, table_slot, pie_slot = result_layout(False, False)
+    for kind, text in query.notes:
+        getattr(status, kind)(text)
+    address, radius = query.key[:2]
+    draw_map(map_slot, query.lat, query.lon, address, radius, query.layers)
+    if query.table is not None:
+        table_slot.dataframe(query.table, key="nearest_pois")
+    if query.pie_data is not None:
+        pie_slot.plotly_chart(landuse_pie(query.pie_data), use_container_width=True, key="landuse_pie",
+                              config = {'height': fig_height})
+    debug_panel(query.record, query.profile)
+
+# Result of a comparison, kept in session state like a Query. `columns` holds one
+# (address, lat, lon, nearest PoIs, grades, pie data) per address that was found.
+Comparison = namedtuple("Comparison", ["key", "radius", "columns", "record", "profile"])
+
+def show_comparison(comparison, trace=None):
+    # map with every address, then one column of scores, pie and nearest PoIs per address;
+    # `trace` times the map when the comparison was just computed
+    columns = comparison.columns
+    m = folium.Map(location=[np.mean([c[1] for c in columns]), np.mean([c[2] for c in columns])], zoom_start=13)
+    for a, lat, lon, *_ in columns:
+        folium.Marker([lat, lon], popup=a, icon=folium.Icon(color='red', icon='home')).add_to(m)
+        folium.Circle(location=[lat, lon], radius=comparison.radius, color='black', fill=False, weight=2.5).add_to(m)
+    with trace.stage("map render") if trace else nullcontext():
+        st_folium(m, height=350, use_container_width=True, returned_objects=[], key="compare_map")
+    
+    for i, (col, (a, lat, lon, results, grades, pie_data)) in enumerate(zip(st.columns(len(columns), gap="small", border=True), columns)):
+        with col:
+            st.subheader(a)
+            col_score, col_grade, col_steep = st.columns(3)
+            col_score.metric("Accessibility", accessibility(results) if results else "–",
+                             help="0–100: how close the nearest PoI of each selected kind is")
+            col_grade.metric("Mean grade", "–" if grades["Mean grade (%)"] is None else f"{grades['Mean grade (%)']} %")
+            col_steep.metric("Steep streets", "–" if grades["Steep streets (%)"] is None else f"{grades['Steep streets (%)']} %",
+                             help="Share of street length steeper than 8%")
+            if pie_data is not None:
+                st.plotly_chart(landuse_pie(pie_data, height=450), use_container_width=True, key=f"compare_pie_{i}")
+            if results:
+                st.dataframe(pd.DataFrame(results).drop(columns="Present"), hide_index=True, key=f"compare_pois_{i}")
+    if comparison.record is not None:
+        debug_panel(comparison.record, comparison.profile)
+
+ms_index, _ = category_lookups()["Multiselect"]
 
 ms_cats = ms_index['Category'].unique()
 
 
 fig_height=700
+max_compare = 4 # addresses side by side in comparison mode
 # -- Set page config
 apptitle = 'Navigator'
 st.set_page_config(page_title=apptitle,
@@ -174,8 +298,15 @@ with tab_map:
     cont_input = st.container()
     col_address, col_features = cont_input.columns(spec= [0.3, 0.7], gap="small", border=True)
     with col_address:
-        address = st.text_input("Enter an address:", value ="Skaldevägen 60")
+        compare = st.toggle("Compare addresses", help=f"Up to {max_compare} addresses side by side, fetched as one region")
+        if compare:
+            compare_input = st.text_area("Enter addresses, one per line:", value="Skaldevägen 60")
+            compare_addresses = list(dict.fromkeys(a.strip() for a in compare_input.splitlines() if a.strip()))[:max_compare]
+        else:
+            address = st.text_input("Enter an address:", value ="Skaldevägen 60")
         POI_radius=st.slider('Show PoIs within:', min_value=100, max_value=2000, value=500)
+        route_mode = st.radio("Nearest PoI by:", list(routing_modes), horizontal=True,
+                              help="Walk and bike times account for street steepness")
         
         no_landuse_input = st.checkbox("Show land use distribution (might take more time)", value =True)
     
@@ -200,93 +331,86 @@ with tab_map:
             selected_poi.extend(selected)
             
     if selected_poi:
-        poi_tags=ms_index[ms_index['Multiselect'].isin(selected_poi)][["key", "value"]].groupby("key")["value"].apply(list).to_dict()
-    
-    #Built environment: get POIs within 500m
-    tags0 = {
-        'landuse': True,   # True → all landuse values
-        'natural': True,   # all natural features
-        'leisure': True,    # all leisure features
-        'amenity':True,
-       # 'shop':True,
-        'building': True,
-    }
+        poi_tags = poi_filter(selected_poi)
     
     
     # If user enters an address => find latitude and longitude
     if st.button("Go!"):
+        query = comparison = None
+        # stage timings and counters of this run, shown in the debug panel and logged
+        trace = Trace(kind="compare" if compare else "query", radius=POI_radius, route_mode=route_mode,
+                      landuse=no_landuse_input, poi=selected_poi)
+        trace.watch("osm", osm_cache.traffic_counts)
+        trace.watch("feature_cache", feature_cache.info)
         
-        if address:
+        if compare and compare_addresses:
+            # Comparison ------------------------------------------------------------------------------------------
+            # one fetch for the region covering every address; each address is then a local query on it
+            with trace.stage("geocode"):
+                located = [(a, geocode_address(a)) for a in compare_addresses]
+            not_found = [a for a, location in located if not location]
+            if not_found:
+                st.error("Address not found: " + ", ".join(not_found))
+            located = [(a, location.latitude, location.longitude) for a, location in located if location]
             
-            location = geocode_address(address)
+            if located:
+                feature_tags = merge_tags(LANDUSE_TAGS if no_landuse_input else {}, poi_tags if selected_poi else {})
+                progress_region = st.progress(0, text="Fetching data for all addresses...")
+                region_graph = fetch_region([(lat, lon) for _, lat, lon in located], POI_radius, feature_tags,
+                                            progress_bar=progress_region, timings=trace.timings)
+                progress_region.empty()
+                trace.count(addresses=len(located), nodes=len(region_graph), edges=region_graph.number_of_edges())
+                
+                columns = []
+                for a, lat, lon in located:
+                    with trace.stage("local queries"):
+                        G = graph_within(region_graph, lat, lon, POI_radius)
+                        features = feature_cache.get(lat, lon, feature_tags, POI_radius) if feature_tags else None
+                    
+                    results = None
+                    if selected_poi:
+                        with trace.stage("shortest paths"):
+                            travel = travel_costs(G, lat, lon, POI_radius, route_mode)
+                        with trace.stage("nearest pois"):
+                            results, _ = nearest_pois(G, poi_points(features, poi_tags), selected_poi, travel)
+                    
+                    pie_data = landuse_areas(features, lat, lon, POI_radius, timings=trace.timings)[1] if no_landuse_input else None
+                    columns.append((a, lat, lon, results, grade_summary(G), pie_data))
+                
+                comparison = Comparison(query_key(tuple(compare_addresses), POI_radius, selected_poi, no_landuse_input, route_mode),
+                                        POI_radius, tuple(columns), None, None)
+                show_comparison(comparison, trace)
+        
+        elif not compare and address:
+            
+            with trace.stage("geocode"):
+                location = geocode_address(address)
     
             if location:
                 lat, lon = location.latitude, location.longitude
                 st.write(f"Coordinates: {lat}, {lon}")
                 
                 #Map --------------------------------------------------------------
+                # The base map shows up right away. Everything else streams into the placeholders
+                # as the task producing it finishes (tasks.py); the grade layer, which waits for
+                # the elevations, comes last.
+                status, map_slot, table_slot, pie_slot = result_layout(bool(selected_poi), no_landuse_input)
+                # map elements per task, added in this order whatever order the tasks finish in
+                map_layers = {name: [] for name in ["land-use layer", "grade layer", "isochrones", "poi layer", "nearest pois"]}
+                notes = []
                 
-                m = folium.Map(location=[lat, lon], zoom_start=14)         
-                # Add address marker
-                folium.Marker([lat, lon], popup=address, icon=folium.Icon(color='red', icon='home')).add_to(m)
-                folium.Circle(
-                    location=[lat, lon],
-                    radius=POI_radius,  # in meters
-                    color='black',       
-                    fill=False,
-                    weight=2.5            
-                    ).add_to(m)
-                 
-                if no_landuse_input:
-                    all_features = get_osm_features(lat, lon, tags0, POI_radius)
-                    #transform to long format
-                    all_features=melt_tags(all_features, tags0.keys())
-                    
-                    # Pie chart data ------------------------------------------------------------------------------------------------------
-                    # get only polygons
-                    polygon_features = all_features[all_features.geometry.geom_type.isin(["Polygon", "MultiPolygon"])]
-                    
-                    clipped=clip_to_circle(gdf=polygon_features, lat=lat, lon=lon, radius=POI_radius)
-                    
-                    #Copmute square meter area per key and value-----------------------
-                    # Project to metric CRS for accurate areas
-                    proj_crs = clipped.estimate_utm_crs()
-                    clipped = clipped.to_crs(proj_crs)
-                    clipped["area_m2"] = clipped.geometry.area
-                    
-                    pie_data0 = clipped.merge(pie_index, on=["key", "value"], how="left")
-                    #pie_data0['pie_cat'] =pie_data0['pie_cat'].fillna('other')
-                    pie_data0 =pie_data0[pie_data0['pie_cat'].notna()] #remove polygons that are not in the pie index
-                    
-                    pie_data = pie_data0.groupby(["pie_cat"]).agg(
-                        total_area_m2 = ("area_m2", "sum"),
-                        values_included=("value", lambda x: ", ".join(sorted(x.unique())))).reset_index() #concantenate all values within the pie_category
-        
-                    pie_data["values_included"] = (pie_data["values_included"].str.replace("_", " ")) #remove underscores from the column (for the popup)
-                    
-                    #pie chart----------------------------------------------------
-                    fig = px.pie(
-                        pie_data,
-                        names="pie_cat",
-                        values="total_area_m2",
-                        hover_data=["values_included"],
-                        color='pie_cat',
-                        color_discrete_map=color_lookup,
-                        hole=.5)
-                    fig.update_traces(
-                        textinfo="percent+label",
-                        pull=[0.05]*len(pie_data),
-                        hovertemplate="<b>%{label}</b><br>%{value:,.0f} m²<br>%{customdata}")
-                    
-                    fig.update_layout(height=fig_height)
-                    
-                    ##Land use layer
-                    keys = pie_data.sort_values("total_area_m2", ascending=False)["pie_cat"].unique()
+                def redraw():
+                    with trace.stage("map render"):
+                        draw_map(map_slot, lat, lon, address, POI_radius, map_layers)
+                    trace.count(map_draws=trace.counts.get("map_draws", 0) + 1)
                 
-                    landuse_layer = folium.FeatureGroup(name="Land use distribution")
-                    
+                redraw()
+                
+                def landuse_layer(landuse):
+                    layer = folium.FeatureGroup(name="Land use distribution")
+                    # only the layer sent to the map goes back to EPSG:4326
                     folium.GeoJson(
-                        data=pie_data0,  # All data at once
+                        data=landuse[0].to_crs(4326),  # All data at once
                         style_function=lambda feature: {
                             "fillColor": color_lookup.get(feature["properties"]["pie_cat"]),
                             "color": "black",
@@ -297,189 +421,195 @@ with tab_map:
                             fields=["pie_cat", "key", "value"],
                             aliases=["In pie chart", "OSM key", "OSM value"]
                         )
-                    ).add_to(landuse_layer)
-                    
-                    landuse_layer.add_to(m)
-                
-                # Elevation data ----------------------------------------------------------------------------------------
-                # 1. Get the street network (nodes + edges)
-                G = ox.graph_from_point((lat, lon), dist=POI_radius, network_type='walk')
-                
-                # 2. Extract nodes only
-                nodes, edges = ox.graph_to_gdfs(G)
-                
-                
-                # # 3. Prepare node coordinates
-                coords = list(zip(nodes.y, nodes.x))
-                batch_size = 100  # OpenTopoData can only take limited locations per request
-                batches = [coords[i:i+batch_size] for i in range(0, len(coords), batch_size)]
-                elevations = []
-                
-                progress_text = "Fetching elevation data..."
-                progress_elevation= st.progress(0, text=progress_text)
-                total_batches = (len(coords) + batch_size - 1) // batch_size  # ceil division
-                
-                # 4. Query the OpenTopoData API in batches
-                for i in range(0, len(coords), batch_size):
-                    batch = coords[i:i+batch_size]
-                    locations = "|".join([f"{lat},{lon}" for lat, lon in batch])
-                    url = f"https://api.opentopodata.org/v1/srtm90m?locations={locations}"
-                    r = requests.get(url)
-                    if r.status_code == 200:
-                        results = r.json().get('results', [])
-                        elevations.extend([r.get('elevation', None) for r in results])
-                    else:
-                        elevations.extend([None]*len(batch))
-                    time.sleep(1)  # avoid rate limit
-                    progress_pct = int((i+1)/total_batches ) #int(((i+1)/total_batches) * 100)
-                    progress_elevation.progress(progress_pct, text=f"{progress_text} ({progress_pct}%)")
-                    
-                progress_elevation.empty()
+                    ).add_to(layer)
+                    return [layer]
                 
+                def elevation_layer(G):
+                    # edges as one GeoJson layer, colored by grade class, with its color scale
+                    max_grade = 0.15 #edges['grade_abs'].max()
+                    colormap = cm.LinearColormap(["yellow","orange",'red', 'purple', 'blue'], vmin=0, vmax=max_grade)
+                    colormap.caption = 'Street Grade (%)'
+                    return [colormap, grade_layer(ox.graph_to_gdfs(G, nodes=False), colormap)]
                 
-                # 5. Add node elevations
-                nodes["elevation"] = elevations
+                def route_layer(G, p4326, travel):
+                    results, routes = nearest_pois(G, p4326, selected_poi, travel)
+                    layer = folium.FeatureGroup(name="Routes to nearest PoI")
+                    for route_gdf, color, tooltip in routes:
+                        folium.GeoJson(
+                            route_gdf[["geometry"]],
+                            style_function=lambda feature, color=color: {"color": color, "weight": 5, "opacity": 0.8},
+                            tooltip=tooltip
+                        ).add_to(layer)
+                    return results, [layer] if routes else []
                 
-                # Replace None or NaN with median (fallback)
-                nodes["elevation"] = pd.to_numeric(nodes["elevation"], errors="coerce")
-                median_elev = nodes["elevation"].median()
-                nodes["elevation"].fillna(median_elev, inplace=True)
-                
-                # 5. Push node elevations back to the graph
-                for node_id, elev in zip(nodes.index, nodes["elevation"]):
-                    G.nodes[node_id]["elevation"] = elev
-                
-                # 6. Compute edge grades (uses node elevations)
-                G = ox.add_edge_grades(G, add_absolute=True)
-                edges = ox.graph_to_gdfs(G, nodes=False)
-                grades = edges['grade_abs'].dropna()  # remove any NaN 
-    
-                #m_elev = folium.Map(location=[lat, lon], zoom_start=14) 
-                elevation_layer = folium.FeatureGroup(name="Street steepness")
-                
-                max_grade = 0.15 #edges['grade_abs'].max()
-                colormap = cm.LinearColormap(["yellow","orange",'red', 'purple', 'blue'], vmin=0, vmax=max_grade)
-                colormap.caption = 'Street Grade (%)'
+                # Every stage with the inputs its result is kept under in this session (None: not
+                # kept), its function and the stages it depends on, in dependency order. A stage
+                # whose inputs are unchanged since an earlier query is not run again: adding a PoI
+                # category only reruns the PoI stages, changing the routing mode only the routing.
+                by_bike = route_mode == "bike time"
+                place = (lat, lon, POI_radius)
+                poi_key = tuple(sorted(selected_poi))
+                kept = st.session_state.setdefault("stage_results", {})  # (stage, inputs): result
+                # Distances need no elevations, so routing by distance starts on the bare streets,
+                # unless the walk graph of this place is kept already
+                if route_mode == "distance" and ("walk graph", place) not in kept:
+                    routing_graph = "streets"
+                else:
+                    routing_graph = "walk graph"
+                # counters of the elevations looked up by this query; empty when the walk graph is
+                # kept or comes from the graph cache
+                elevation_stats = {}
+                stages = {
+                    # the one Overpass query for what the stages below still need (land use + PoIs)
+                    "features": (None, lambda tags: feature_cache.get(lat, lon, tags, POI_radius), ()),
+                    "streets": (None, lambda: get_street_graph(lat, lon, POI_radius, timings=trace.timings), ()),
+                    # walk network with node elevations and edge grades
+                    "walk graph": (place, lambda streets, progress_bar: get_walk_graph(lat, lon, POI_radius, progress_bar=progress_bar,
+                                                                         timings=trace.timings, streets=streets, stats=elevation_stats),
+                                   ("streets",)),
+                    # classified polygons clipped to the circle, and every m² counted once per category
+                    "land use": (place, lambda features: landuse_areas(features, lat, lon, POI_radius, timings=trace.timings),
+                                 ("features",)),
+                    "land-use layer": (place, landuse_layer, ("land use",)),
+                    "grade layer": (place, elevation_layer, ("walk graph",)),
+                    # one bounded Dijkstra from home with the chosen mode's edge weight (meters or seconds);
+                    # isochrones and every PoI distance are read from its result
+                    "shortest paths": (place + (route_mode,), lambda G: travel_costs(G, lat, lon, POI_radius, route_mode),
+                                       (routing_graph,)),
+                    "isochrones": (place + (route_mode,), lambda G, travel: [isochrone_layer(
+                        isochrones(G, travel["cost"], travel["limits"], weight=travel["weight"]), iso_minutes,
+                        travel="by bike" if by_bike else "walk", name="Cycling time" if by_bike else "Walking time")],
+                        (routing_graph, "shortest paths")),
+                    "poi points": (place + (poi_key,), lambda features: poi_points(features, poi_tags), ("features",)),
+                    "poi layer": (place + (poi_key,), lambda p4326: [poi_layer(p4326)] if len(p4326) else [], ("poi points",)),
+                    "nearest pois": (place + (route_mode, poi_key), route_layer, (routing_graph, "poi points", "shortest paths")),
+                }
+                shown = ["walk graph", "isochrones"]
+                if no_landuse_input:
+                    shown += ["land use", "land-use layer"]
+                if selected_poi:
+                    shown += ["poi layer", "nearest pois"]
                 
-                # 10. Add edges as polylines with color based on grade
-                for _, row in edges.iterrows():
-                    coords = [(y, x) for x, y in row.geometry.coords]
-                    color = colormap(row['grade_abs'])
-                    folium.PolyLine(coords, color=color, weight=3, opacity=0.8).add_to(elevation_layer)
+                run = {}  # stage: True to run it, False if kept
+                def plan(name):
+                    key, _, deps = stages[name]
+                    if name in run:
+                        return
+                    if key is not None and (name, key) in kept:
+                        run[name] = False
+                        return
+                    for dep in deps:
+                        plan(dep)
+                    run[name] = True
+                for name in shown + ["grade layer"]:
+                    plan(name)
+                trace.count(stages_run=sum(run.values()), stages_kept=len(run) - sum(run.values()))
                 
-                # 11. Add the color scale
-                colormap.add_to(m)
-                elevation_layer.add_to(m)
+                # what depends on the plan is passed to the stages when they are added: the tags
+                # still to fetch, and the progress bar of the elevations if they are fetched
+                stage_args = {"features": {"tags": merge_tags(LANDUSE_TAGS if run.get("land use") else {},
+                                                              poi_tags if run.get("poi points") else {})}}
+                if run.get("walk graph"):
+                    progress_elevation = status.progress(0, text="Fetching elevation data...")
+                    stage_args["walk graph"] = {"progress_bar": progress_elevation}
                 
-                if selected_poi:
-                    ms_poi = get_osm_features(lat, lon, poi_tags, POI_radius)
-                    poi_data = melt_tags(ms_poi, poi_tags.keys()).reset_index().merge(ms_poi.reset_index()[["id", "name"]], on="id").merge(ms_index[["Category", "Multiselect", "key", "value", "color", "icon"]], on=["key", "value"])
-                    poi_data.loc[poi_data['name'].isna(), 'name']="Unnamed"
-                     
-                    #add layer with PoI markers to map                              
-                    poi_layer = folium.FeatureGroup(name="Points of Interest")
-                    
-                    for idx, row in poi_data.iterrows():
-                        lon_, lat_ = row.geometry.centroid.xy
-                        folium.Marker(
-                            location=[lat_[0], lon_[0]],
-                            popup= f"<div style='font-size:12px; font-family:Arial; white-space:nowrap;'><b>{row.get("Category",'N/A').capitalize()}: </b>{row.get('Multiselect')}<br>{row.get('name', 'Unnamed')}",
-                            icon=folium.Icon(
-                                color=row['color'],
-                                icon=row['icon'].replace("fa-", "") if str(row['icon']).startswith("fa-") else row['icon'],
-                                prefix="fa" if str(row['icon']).startswith("fa-") else None
-                            )
-                            
-                            ).add_to(poi_layer)
-                             
-                    poi_layer.add_to(m)
-                    
-                    #Available PoI: ---------------------------------------------------------------------------------
-                    G = ox.graph_from_point((lat, lon), dist=POI_radius, network_type='walk')
-                    home_node = ox.nearest_nodes(G, lon, lat)
+                with TaskGraph(wrap=in_session(trace)) as tasks:
+                    for name, (key, fn, deps) in stages.items():
+                        if run.get(name):
+                            tasks.add(name, partial(fn, **stage_args.get(name, {})), *deps)
+                        elif name in run:
+                            tasks.add_result(name, kept[(name, key)])
                     
-                    #change crs to compute centroids of the polygons
-                    p3857 = poi_data.to_crs(epsg=3857) 
-                    p3857['centroide'] = p3857.geometry.centroid
-                    p3857=p3857.set_geometry("centroide")
-    
-                    p4326=p3857.to_crs(epsg=4326)
-    
-                    results = []
-                    
-                    for cat in selected_poi:
-                       
-                        filtered = p4326[p4326["Multiselect"] == cat]
-                        if filtered.empty:
-                            results.append({"Category": cat, "Present": "No", "Name of nearest": None, "Distance to nearest (m)": None})
-                            continue
-                    
-                        # map each POI geometry to nearest node
-                        filtered = filtered.copy()
-                       
-                        filtered["node"] = filtered.geometry.apply(lambda geom: ox.nearest_nodes(G, geom.x, geom.y))
-                        # compute walk distance for each
-                        filtered["walk_dist_m"] = filtered["node"].apply( lambda target_node: nx.shortest_path_length(G, home_node, target_node, weight='length'))
+                    def show(name):
+                        # puts a finished stage on the page; True if the map needs redrawing
+                        if name == "land use":
+                            pie_data0, pie_data = tasks.result("land use")
+                            trace.count(landuse_polygons=len(pie_data0))
+                            #pie chart----------------------------------------------------
+                            pie_slot.plotly_chart(landuse_pie(pie_data),
+                                                  use_container_width=True,
+                                                  key="landuse_pie",
+                                                  config = {'height': fig_height})
+                            return False
                         
-                        # pick nearest by walking
-                        nearest = filtered.to_crs(epsg=4326).loc[filtered["walk_dist_m"].idxmin()]
+                        if name == "walk graph":
+                            # Elevation data ----------------------------------------------------------------------------------------
+                            G = tasks.result("walk graph")
+                            if run["walk graph"]:
+                                progress_elevation.empty()
+                            trace.count(nodes=len(G), edges=G.number_of_edges(), walk_graph_cached=not elevation_stats,
+                                        **{f"elevation_{k}": v for k, v in elevation_stats.items() if isinstance(v, (int, float))})
+                            if "cache_hits" in elevation_stats:
+                                notes.append(("caption", f"Elevation cache: {elevation_stats['cache_hits']} hits, {elevation_stats['cache_misses']} misses"))
+                            if elevation_stats.get("remote_failed"):
+                                notes.append(("warning", f"Elevation could not be fetched for {elevation_stats['remote_failed']} locations; the median elevation is used there."))
+                            for kind, text in notes:
+                                getattr(status, kind)(text)
+                            return False
                         
-                        results.append({"Point of interest": cat,
-                                        "Present": "Yes",
-                                        "Name of nearest": nearest["name"],
-                                        "Distance to nearest (m)": round(nearest["walk_dist_m"])
-                                       })
-                    resdf=pd.DataFrame(results)
+                        if name == "nearest pois":
+                            #Available PoI: ---------------------------------------------------------------------------------
+                            results, map_layers[name] = tasks.result("nearest pois")
+                            table_slot.dataframe(pd.DataFrame(results), key="nearest_pois")
+                        else:
+                            map_layers[name] = tasks.result(name)
+                        return bool(map_layers[name])
                     
-                
-               
-                
-                
-                
-                folium.LayerControl().add_to(m)
-                
-                col1,col2 = st.columns(2, gap="small", border=True)    
-                
-                with col1:
-                    # st.subheader("Map")
-                    # st.write("Here you can see land use patterns, elevation profile and where your points of interest are located")
-                    st_folium(m,use_container_width=True)
-                    
-                    with st.popover("Degree reference values"):
-                        st.markdown("""
-                            - **0–2%**: Very flat street, easy to walk or bike  
-                            - **2–5%**: Slight incline, barely noticeable  
-                            - **5–8%**: Moderate slope, noticeable uphill effort  
-                            - **8–12%**: Steep street, challenging for bikes or long walks  
-                            - **>12%**: Very steep, strenuous; may be difficult for vehicles, bicycles, or accessibility
-                            """)
-                    st.header("Nearest points of interest")
-                            
-                    if 'resdf' in locals() and not resdf.empty:
-                        st.dataframe(resdf, key="nearest_pois")
-                    else:
-                        st.info("No Points of interest selected.")
-                    
-                    
-                with col2:
-                    st.subheader("Land use distribution")
+                    # Stages finished by the time the page is updated are shown together, with one
+                    # map redraw for all of them; stages that add nothing to the map cause none.
+                    # The grade layer comes last, in the last batch if it is done by then.
+                    pending, finished = list(shown), []
+                    while pending:
+                        finished = tasks.wait(pending)
+                        pending = [name for name in pending if name not in finished]
+                        if not pending:
+                            finished += tasks.wait(["grade layer"], timeout=0)
+                        if any([show(name) for name in finished]):
+                            redraw()
+                    if "grade layer" not in finished and show("grade layer"):
+                        redraw()
                     
-                    if 'fig' in locals():
-                        st.plotly_chart(fig,
-                                        use_container_width=True,
-                                        key="landuse_pie",
-                                        config = {'height': fig_height})
-                    else:
-                        st.info("No landuse characteristics were obtained. If you want to see the landuse distribution, mark the checkbox")
-                   
+                    if run.get("features"):
+                        trace.count(features=len(tasks.result("features")))
+                    if run.get("poi points"):
+                        trace.count(pois=len(tasks.result("poi points")))
                     
-               
+                    # keep this place's stage results for the next query; other places are dropped
+                    for key in [key for key in kept if key[1][:3] != place]:
+                        del kept[key]
+                    for name, ran in run.items():
+                        key = stages[name][0]
+                        if ran and key is not None:
+                            kept[(name, key)] = tasks.result(name)
                 
-                    
+                query = Query(query_key(address, POI_radius, selected_poi, no_landuse_input, route_mode), lat, lon,
+                              map_layers, pd.DataFrame(tasks.result("nearest pois")[0]) if selected_poi else None,
+                              tasks.result("land use")[1] if no_landuse_input else None,
+                              tuple(notes), None, None)
     
     
             else:
                 st.error("Address not found!")
+        
+        record = trace.finish()
+        if query is not None:
+            st.session_state["query"] = query._replace(record=record, profile=trace.profile)
+        if comparison is not None:
+            st.session_state["comparison"] = comparison._replace(record=record, profile=trace.profile)
+        debug_panel(record, trace.profile)
+    
+    # a rerun without Go! (another widget changed): the last result again, nothing recomputed
+    elif not compare and "query" in st.session_state:
+        query = st.session_state["query"]
+        if query.key != query_key(address, POI_radius, selected_poi, no_landuse_input, route_mode):
+            st.info(f"Results for {query.key[0]} as last computed. Press Go! to update them.")
+        show_query(query)
+    
+    elif compare and "comparison" in st.session_state:
+        comparison = st.session_state["comparison"]
+        if comparison.key != query_key(tuple(compare_addresses), POI_radius, selected_poi, no_landuse_input, route_mode):
+            st.info(f"Comparison of {', '.join(comparison.key[0])} as last computed. Press Go! to update it.")
+        show_comparison(comparison)
                 
                 
 
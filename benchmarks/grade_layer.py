@@ -0,0 +1,80 @@
+"""Street grade layer: per-edge folium.PolyLine loop vs. the single GeoJson layer.
+
+Runs offline on a synthetic street grid (~70 m blocks, 4 vertices per edge) sized like
+the walk network for each radius, and reports build time and rendered HTML size.
+
+    python benchmarks/grade_layer.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import branca.colormap as cm
+import folium
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import LineString
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from layers import grade_layer  # noqa: E402
+
+LAT, LON = 59.3293, 17.9286
+BLOCK_M = 70
+
+
+def synthetic_edges(radius, seed=0):
+    rng = np.random.default_rng(seed)
+    n = int(2 * radius / BLOCK_M) + 1
+    dlat = BLOCK_M / 111_320
+    dlon = dlat / np.cos(np.radians(LAT))
+    lines = []
+    for i in range(n):
+        for j in range(n - 1):
+            for a, b in (((i, j), (i, j + 1)), ((j, i), (j + 1, i))):
+                ys = np.linspace(a[0], b[0], 4) * dlat + LAT - radius / 111_320
+                xs = np.linspace(a[1], b[1], 4) * dlon + LON - radius / 111_320 / np.cos(np.radians(LAT))
+                xs[1:-1] += rng.normal(0, dlon / 20, 2)
+                line = LineString(zip(xs, ys))
+                lines += [line, line.reverse()]  # walk graphs have both directions
+    grades = np.abs(rng.normal(0, 0.04, len(lines)))
+    grades[rng.random(len(lines)) < 0.002] = np.nan
+    return gpd.GeoDataFrame({"grade_abs": grades}, geometry=lines, crs=4326)
+
+
+def colormap():
+    c = cm.LinearColormap(["yellow", "orange", 'red', 'purple', 'blue'], vmin=0, vmax=0.15)
+    c.caption = 'Street Grade (%)'
+    return c
+
+
+def polyline_loop(edges, colormap):
+    # the previous implementation (NaN grades skipped, branca cannot color them)
+    layer = folium.FeatureGroup(name="Street steepness")
+    for _, row in edges.dropna(subset=["grade_abs"]).iterrows():
+        coords = [(y, x) for x, y in row.geometry.coords]
+        folium.PolyLine(coords, color=colormap(row['grade_abs']), weight=3, opacity=0.8).add_to(layer)
+    return layer
+
+
+def measure(build, edges):
+    m = folium.Map(location=[LAT, LON], zoom_start=14)
+    t0 = time.perf_counter()
+    build(edges, colormap()).add_to(m)
+    t_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    html = m.get_root().render()
+    t_render = time.perf_counter() - t0
+    return t_build, t_render, len(html.encode())
+
+
+def main():
+    print(f"{'radius':>6} {'edges':>6} {'method':>9} {'build s':>8} {'render s':>9} {'HTML MB':>8}")
+    for radius in (500, 1000, 2000):
+        edges = synthetic_edges(radius)
+        for label, build in (("polyline", polyline_loop), ("geojson", grade_layer)):
+            t_build, t_render, size = measure(build, edges)
+            print(f"{radius:>6} {len(edges):>6} {label:>9} {t_build:>8.2f} {t_render:>9.2f} {size / 1e6:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
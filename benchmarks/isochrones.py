@@ -0,0 +1,67 @@
+"""Isochrones from one shortest-path tree on a synthetic 2 km walk graph (no network).
+
+The graph is a jittered street grid in the shape OSMnx returns (MultiDiGraph, both
+directions, lon/lat nodes, `length` on edges, curved `geometry` on some), dense enough to
+stand in for a city-center 2 km query. Times the shortest-path tree, the one-off edge
+arrays and the 5/10/15-minute polygons.
+
+    python benchmarks/isochrones.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+import shapely
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from network import isochrones, shortest_path_tree, snap_to_nodes, walk_speed  # noqa: E402
+
+
+def grid_graph(lat=59.33, lon=18.06, radius=2000, spacing=35, seed=0):
+    rng = np.random.default_rng(seed)
+    n = int(2 * radius / spacing) + 1
+    dlat = spacing / 111_320
+    dlon = dlat / np.cos(np.radians(lat))
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    for i in range(n):
+        for j in range(n):
+            G.add_node(i * n + j, y=lat + (i - n / 2 + rng.normal(0, 0.1)) * dlat, x=lon + (j - n / 2 + rng.normal(0, 0.1)) * dlon)
+    for i in range(n):
+        for j in range(n):
+            for a, b in ((i * n + j, i * n + j + 1) if j + 1 < n else (None, None), ((i + 1) * n + j, i * n + j) if i + 1 < n else (None, None)):
+                if a is None or rng.random() < 0.1:  # some blocks are merged
+                    continue
+                pa, pb = G.nodes[a], G.nodes[b]
+                data = {"length": spacing * (1 + rng.uniform(0, 0.2))}
+                if rng.random() < 0.3:  # curved street
+                    mid = ((pa["x"] + pb["x"]) / 2 + rng.normal(0, 0.1) * dlon, (pa["y"] + pb["y"]) / 2 + rng.normal(0, 0.1) * dlat)
+                    data["geometry"] = shapely.LineString([(pa["x"], pa["y"]), mid, (pb["x"], pb["y"])])
+                G.add_edge(a, b, **data)
+                G.add_edge(b, a, **{**data, "geometry": shapely.reverse(data["geometry"])} if "geometry" in data else data)
+    return G
+
+
+def main():
+    minutes = [5, 10, 15]
+    for spacing in (70, 50, 35):
+        G = grid_graph(spacing=spacing)
+        home = snap_to_nodes(G, [18.06], [59.33])[0]
+
+        t0 = time.perf_counter()
+        dist, pred = shortest_path_tree(G, home, cutoff=max(minutes) * walk_speed)
+        t1 = time.perf_counter()
+        isochrones(G, dist, [m * walk_speed for m in minutes])  # includes the one-off edge arrays
+        t2 = time.perf_counter()
+        polygons = isochrones(G, dist, [m * walk_speed for m in minutes])
+        t3 = time.perf_counter()
+
+        sizes = ", ".join(f"{m} min {shapely.area(shapely.transform(p, lambda xy: xy * [111_320 * np.cos(np.radians(59.33)), 111_320])) / 1e6:.2f} km²" for m, p in zip(minutes, polygons))
+        print(f"{len(G):>6} nodes {G.number_of_edges():>6} edges: tree {(t1 - t0) * 1e3:5.0f} ms, "
+              f"polygons {(t3 - t2) * 1e3:5.0f} ms (first call {(t2 - t1) * 1e3:5.0f} ms); {sizes}")
+
+
+if __name__ == "__main__":
+    main()
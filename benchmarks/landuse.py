@@ -0,0 +1,145 @@
+"""Land-use clipping and areas: previous clip/reproject pipeline vs. landuse.clip_to_circle.
+
+Replays the recorded Overpass responses in cache/ (no network), keeps the classified
+land-use polygons and clips them to a circle around the middle of the response, with a
+radius reaching its edges (2 km for the tiled cases: the largest response repeated on
+a grid). Areas are checked to agree; stage timings of the new pipeline are listed.
+
+    python benchmarks/landuse.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+import lookups  # noqa: E402
+from features import melt_tags  # noqa: E402
+import shapely  # noqa: E402
+from landuse import PRIORITY, circle_area, clip_to_circle, resolve_overlaps  # noqa: E402
+from melt_tags import LANDUSE_KEYS, frames  # noqa: E402
+
+
+def old_pipeline(gdf, lat, lon, radius):
+    # the previous implementation: UTM and back for clipping, then UTM again for areas
+    proj_crs = gdf.estimate_utm_crs()
+    circle = gpd.GeoSeries([Point(lon, lat)], crs=4326).to_crs(proj_crs).buffer(radius)
+    clipped = gpd.clip(gdf.to_crs(proj_crs), circle).to_crs(4326)
+    clipped = clipped.to_crs(clipped.estimate_utm_crs())
+    clipped["area_m2"] = clipped.geometry.area
+    return clipped
+
+
+def new_pipeline(gdf, lat, lon, radius):
+    timings = {}
+    out = clip_to_circle(gdf, lat, lon, radius, timings=timings)
+    t0 = time.perf_counter()
+    out.to_crs(4326)  # the layer sent to the map
+    timings["reproject"] = time.perf_counter() - t0
+    return out, timings
+
+
+def tiled(gdf, n):
+    # n x n copies on a grid, as a stand-in for a large dense area
+    w, s, e, north = gdf.total_bounds
+    parts = []
+    for i in range(n):
+        for j in range(n):
+            part = gdf.copy()
+            part.geometry = part.geometry.translate(i * (e - w), j * (north - s))
+            parts.append(part)
+    return gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), crs=gdf.crs)
+
+
+def circle_around(gdf):
+    w, s, e, n = gdf.total_bounds
+    lat, lon = (s + n) / 2, (w + e) / 2
+    return lat, lon, min(e - w, n - s) / 2 * 111_320 * min(1, np.cos(np.radians(lat)))
+
+
+def timed(fn, *args, repeat=5):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def synthetic_layout(buildings, radius=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    n = int(np.sqrt(buildings))
+    x, y = np.meshgrid(np.linspace(-radius, radius, n), np.linspace(-radius, radius, n))
+    x, y = x.ravel() + rng.normal(0, 3, n * n), y.ravel()
+    houses = shapely.box(x, y, x + rng.uniform(8, 22, n * n), y + rng.uniform(8, 22, n * n))
+    house_cat = np.where(rng.random(n * n) < 0.8, "residential buildings", "commercial buildings")
+    bx, by = (v.ravel() for v in np.meshgrid(np.arange(-radius, radius, 400), np.arange(-radius, radius, 400)))
+    blocks = shapely.box(bx, by, bx + 420, by + 420)
+    block_cat = rng.choice(["other landuse", "retail area", "industrial area"], len(blocks))
+    px, py, pr = rng.uniform(-radius, radius, 60), rng.uniform(-radius, radius, 60), rng.uniform(50, 250, 60)
+    parks = shapely.buffer(shapely.points(px, py), pr)
+    woods = shapely.buffer(shapely.points(px + 40, py), pr)
+    geoms = np.concatenate([houses, blocks, parks, woods])
+    cats = np.concatenate([house_cat, block_cat, ["leisure"] * 60, ["trees"] * 60])
+    circle = shapely.Point(0, 0).buffer(radius)
+    inside = shapely.intersects(geoms, circle)
+    return gpd.GeoDataFrame({"pie_cat": cats[inside]}, geometry=shapely.intersection(geoms[inside], circle), crs=32634)
+
+
+def sequential_union(gdf):
+    # reference: each category minus the union of everything ranked above it
+    areas, taken = {}, shapely.Polygon()
+    for cat in sorted(gdf["pie_cat"].unique(), key=PRIORITY.index):
+        own = shapely.union_all(gdf.geometry[gdf["pie_cat"] == cat].to_numpy())
+        areas[cat] = shapely.difference(own, taken).area
+        taken = shapely.union(taken, own)
+    return areas
+
+
+def overlaps():
+    print(f"\n{'layout':>14} {'polygons':>8} {'raw m2':>10} {'circle m2':>10} {'union ms':>9} {'new ms':>8} {'speedup':>8}  note")
+    for buildings in (2_500, 10_000, 22_500):
+        gdf = synthetic_layout(buildings)
+        t_old, old = timed(sequential_union, gdf, repeat=1)
+        t_new, new = timed(resolve_overlaps, gdf, PRIORITY, circle_area(2000), repeat=3)
+        new = dict(zip(new["pie_cat"], new["area_m2"]))
+        ok = all(np.isclose(new[cat], area, rtol=1e-9, atol=1e-6) for cat, area in old.items())
+        print(f"{f'{buildings} houses':>14} {len(gdf):>8} {gdf.area.sum():>10.3g} {circle_area(2000):>10.3g} "
+              f"{t_old * 1e3:>9.0f} {t_new * 1e3:>8.0f} {t_old / t_new:>7.1f}x  {'same areas' if ok else 'MISMATCH'}")
+
+
+def main():
+    _, pie_lookup = lookups.load(ROOT / "lookups.json", ROOT / "OSM features.xls")["pie_index"]
+    cases = []
+    for name, gdf in frames():
+        polys = pie_lookup.join(melt_tags(gdf, LANDUSE_KEYS))
+        polys = polys[polys.geometry.geom_type.isin(["Polygon", "MultiPolygon"])].reset_index(drop=True)
+        if len(polys):
+            cases.append((name, polys))
+    biggest = max(cases, key=lambda c: len(c[1]))
+    for n in (3, 6):
+        cases.append((f"{biggest[0]} {n}x{n}", tiled(biggest[1], n)))
+
+    print(f"{'response':>14} {'polygons':>8} {'radius':>7} {'old ms':>8} {'new ms':>8} {'speedup':>8}  {'stages (ms)':<44} note")
+    for name, polys in cases:
+        lat, lon, radius = circle_around(polys)
+        if "x" in name:
+            radius = 2000
+        t_new, (new, timings) = timed(new_pipeline, polys, lat, lon, radius)
+        try:
+            t_old, old = timed(old_pipeline, polys, lat, lon, radius)
+        except ValueError:  # estimate_utm_crs of an empty clip
+            t_old, old = float("nan"), polys.iloc[:0].assign(area_m2=0.0)
+        ok = np.isclose(old["area_m2"].sum(), new["area_m2"].sum(), rtol=1e-9) and len(old) == len(new)
+        stages = " ".join(f"{k} {v * 1e3:.1f}" for k, v in timings.items())
+        print(f"{name:>14} {len(polys):>8} {radius:>7.0f} {t_old * 1e3:>8.1f} {t_new * 1e3:>8.1f} {t_old / t_new:>7.1f}x  {stages:<44} {'same areas' if ok else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
+    overlaps()
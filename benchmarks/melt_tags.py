@@ -0,0 +1,117 @@
+"""melt_tags + lookup join: previous stack/merge implementation vs. the positional one.
+
+Replays the recorded Overpass responses in cache/ (no network). Each response is parsed
+into a feature GeoDataFrame the way OSMnx does it; the largest one is also tiled 10x and 100x
+to stand in for building-heavy 2 km queries. For every frame both implementations melt
+the land-use keys and classify them against the pie index, and the PoI keys against
+the multiselect index; results are checked to be identical.
+
+    python benchmarks/melt_tags.py
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+import geopandas as gpd
+import osmnx as ox
+import pandas as pd
+from shapely.geometry import box
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from features import TagLookup, melt_tags  # noqa: E402
+
+LANDUSE_KEYS = ['landuse', 'natural', 'leisure', 'amenity', 'building']
+
+
+def load_index(sheet):
+    df = pd.read_excel(ROOT / "OSM features.xls", sheet_name=sheet)
+    df = df.dropna(subset=["key", "value"])
+    df["key"] = df["key"].astype(str).str.strip()
+    df["value"] = df["value"].astype(str).str.strip()
+    return df
+
+
+def melt_tags_stack(gdf, tag_keys):
+    # the previous implementation
+    tag_keys = [k for k in tag_keys if k in gdf.columns]
+    melted = gdf[tag_keys].stack().reset_index().rename(columns={"level_2": "key", 0: "value"})
+    melted = melted.merge(gdf.reset_index()[["id", "geometry"]], on="id")
+    melted = melted.drop(columns="element")
+    return gpd.GeoDataFrame(melted, geometry="geometry", crs=gdf.crs)
+
+
+def old_pipeline(gdf, pie_index, ms_index, poi_keys):
+    pie = melt_tags_stack(gdf, LANDUSE_KEYS).merge(pie_index, on=["key", "value"], how="left")
+    pie = pie[pie['pie_cat'].notna()]
+    poi = (melt_tags_stack(gdf, poi_keys).reset_index().merge(gdf.reset_index()[["id", "name"]], on="id")
+           .merge(ms_index[["Category", "Multiselect", "key", "value", "color", "icon"]], on=["key", "value"]))
+    return pie, poi
+
+
+def new_pipeline(gdf, pie_lookup, ms_lookup, poi_keys):
+    pie = pie_lookup.join(melt_tags(gdf, LANDUSE_KEYS))
+    poi = ms_lookup.join(melt_tags(gdf, poi_keys, keep=["name"]))
+    return pie, poi
+
+
+def frames():
+    world = box(-180, -90, 180, 90)
+    for f in sorted((ROOT / "cache").glob("*.json")):
+        elements = json.loads(f.read_text())["elements"]
+        keys = {k for e in elements for k in e.get("tags", {})} & set(LANDUSE_KEYS + ["shop", "railway", "public_transport"])
+        if keys and len(elements) > 100:
+            yield f.stem[:8], ox.features._create_gdf([{"elements": elements}], world, {k: True for k in keys})
+
+
+def tiled(gdf, n):
+    # n copies with distinct ids, as a stand-in for a much denser area
+    parts = []
+    for i in range(n):
+        part = gdf.reset_index()
+        part["id"] = part["id"] + i * 10**11
+        parts.append(part)
+    return gpd.GeoDataFrame(pd.concat(parts), crs=gdf.crs).set_index(["element", "id"])
+
+
+def same(a, b, cols):
+    key = lambda df: df[cols].astype(str).sort_values(cols).reset_index(drop=True)
+    return key(a).equals(key(b))
+
+
+def timed(fn, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main():
+    pie_index = load_index("pie_index")
+    ms_index = load_index("Multiselect")
+    ms_index = ms_index[ms_index['Multiselect'].notna()]
+    pie_lookup = TagLookup(pie_index, ["pie_cat"])
+    ms_lookup = TagLookup(ms_index, ["Category", "Multiselect", "color", "icon"])
+    poi_keys = ms_index["key"].unique().tolist()
+
+    cases = list(frames())
+    biggest = max(cases, key=lambda c: len(c[1]))
+    for n in (10, 100):
+        cases.append((f"{biggest[0]} x{n}", tiled(biggest[1], n)))
+
+    print(f"{'response':>14} {'features':>8} {'old ms':>8} {'new ms':>8} {'speedup':>8}  note")
+    for name, gdf in cases:
+        t_old, (pie_old, poi_old) = timed(old_pipeline, gdf, pie_index, ms_index, poi_keys)
+        t_new, (pie_new, poi_new) = timed(new_pipeline, gdf, pie_lookup, ms_lookup, poi_keys)
+        # the old merges duplicate rows for (key, value) pairs listed twice in the sheets
+        pie_old = pie_old.drop_duplicates(["id", "key", "value"])
+        poi_old = poi_old.drop_duplicates(["id", "key", "value"])
+        ok = same(pie_old, pie_new, ["id", "key", "value", "pie_cat"]) and same(poi_old, poi_new, ["id", "key", "value", "Multiselect"])
+        print(f"{name:>14} {len(gdf):>8} {t_old * 1e3:>8.1f} {t_new * 1e3:>8.1f} {t_old / t_new:>7.1f}x  {'same rows' if ok else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Offline benchmark of the whole Go! pipeline, checked against a stored baseline.
+
+Features are replayed from the recorded Overpass responses in cache/ (parsed once the
+way OSMnx parses them, then cut to each query's bbox and tags like a cache hit). The
+walk graph is a synthetic street grid (benchmarks/isochrones.py) and elevations come
+from synthetic terrain, so nothing touches the network. Every scenario, a radius and
+a PoI selection, runs the app's stages in order: features, land use, land-use layer,
+walk graph preparation, grade layer, shortest paths, isochrones, PoI points, nearest
+PoIs and map rendering. Per stage it reports the best wall time of --repeat runs,
+the peak memory traced during the stage (one extra run under tracemalloc) and the size
+of what the stage produced. Sub-stages timed inside the pipeline (clip, overlaps,
+elevation, ...) are listed with their times only.
+
+    python benchmarks/suite.py                    # compare with benchmarks/baseline.json
+    python benchmarks/suite.py --save-baseline    # record the baseline on this machine
+    python benchmarks/suite.py --radius 500 1000 --poi daily --threshold 0.5
+
+Exits with status 1 when a stage is slower than its baseline by more than --threshold
+(a fraction, 0.5 by default: timings on a shared machine easily vary by 30%) and by
+more than --min-ms. Timings depend on the machine: record the baseline where the
+comparison runs.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import branca.colormap as cm
+import folium
+import numpy as np
+import osmnx as ox
+from shapely.geometry import box
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from features import FeatureCache, _frame_bytes, merge_tags, select_features  # noqa: E402
+from layers import grade_layer, isochrone_layer, poi_layer  # noqa: E402
+from network import earth_radius_m, isochrones, prepare_walk_graph  # noqa: E402
+from pipeline import (LANDUSE_TAGS, category_lookups, iso_minutes, landuse_areas, nearest_pois,  # noqa: E402
+                      poi_filter, poi_points, travel_costs)
+from isochrones import grid_graph  # noqa: E402
+
+BASELINE = Path(__file__).with_name("baseline.json")
+RADII = [250, 500, 1000, 2000]
+POI_SELECTIONS = {
+    "none": [],
+    "daily": ["supermarket", "school", "playground", "public transport station"],
+    "many": ["supermarket", "school", "playground", "public transport station", "cafe", "restaurant",
+             "pharmacy", "park", "bakery", "bank", "kindergarten", "library"],
+}
+
+
+class SyntheticTerrain:
+    # rolling hills (about ±35 m over a few hundred meters) in place of a DEM, with the
+    # elevation providers' interface
+    def elevations(self, lats, lons, progress_bar=None, stats=None):
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        y = np.radians(lats) * earth_radius_m
+        x = np.radians(lons) * earth_radius_m * np.cos(np.radians(lats.mean()))
+        return 25 * np.sin(x / 700) * np.cos(y / 500) + 10 * np.sin(x / 170 + y / 230)
+
+
+def recorded_features():
+    # every recorded response parsed into one feature frame, as OSMnx builds it
+    responses = [json.loads(f.read_text()) for f in sorted((ROOT / "cache").glob("*.json"))]
+    responses = [r for r in responses if isinstance(r, dict) and r.get("elements")]
+    keys = {k for r in responses for e in r["elements"] for k in e.get("tags", {})}
+    keys &= set(LANDUSE_TAGS) | {"shop", "railway", "public_transport", "highway"}
+    gdf = ox.features._create_gdf(responses, box(-180, -90, 180, 90), {k: True for k in keys})
+    w, s, e, n = gdf.total_bounds
+    return gdf, (s + n) / 2, (w + e) / 2
+
+
+def replay(recorded):
+    # stands in for the Overpass query: the recorded features in the bbox, with the tags
+    def fetch(lat, lon, tags, dist):
+        bbox = ox.utils_geo.bbox_from_point((lat, lon), dist=dist)
+        hits = recorded.sindex.query(ox.utils_geo.bbox_to_poly(bbox), predicate="intersects")
+        return select_features(recorded.iloc[np.sort(hits)], tags)
+    return fetch
+
+
+def _size(out):
+    # bytes of a stage's output: frames by their estimated footprint, layers by their GeoJSON
+    if out is None:
+        return None
+    if hasattr(out, "geometry"):
+        return _frame_bytes(out)
+    if isinstance(out, str):
+        return len(out.encode("utf-8"))
+    if isinstance(out, folium.GeoJson):
+        return len(json.dumps(out.data))
+    if isinstance(out, folium.map.FeatureGroup):
+        return sum(_size(child) or 0 for child in out._children.values())
+    return None
+
+
+def run(scenario, recorded, center, memory=False):
+    """One pass of the pipeline: {stage: (seconds, peak bytes or None, output bytes or None)}."""
+    radius, pois = scenario["radius"], scenario["pois"]
+    lat, lon = center
+    stats, timings = {}, {}
+    G = grid_graph(lat, lon, radius=radius, spacing=50)  # the download, not timed
+
+    def stage(name, fn):
+        gc.collect()  # no collection of an earlier stage's garbage inside this one
+        if memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        out = fn()
+        seconds = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] - before if memory else None
+        stats[name] = (seconds, peak, _size(out[0] if isinstance(out, tuple) else out))
+        return out
+
+    m = folium.Map(location=[lat, lon], zoom_start=14)
+    tags = poi_filter(pois) if pois else {}
+    feature_tags = merge_tags(LANDUSE_TAGS, tags)
+    cache = FeatureCache()
+    features = stage("features", lambda: cache.get(lat, lon, feature_tags, radius, fetch=replay(recorded)))
+    polygons, _ = stage("land use", lambda: landuse_areas(features, lat, lon, radius, timings=timings))
+
+    def landuse_layer():
+        layer = folium.GeoJson(polygons.to_crs(4326), style_function=lambda feature: {"weight": 0.3})
+        layer.add_to(m)
+        return layer
+    stage("land-use layer", landuse_layer)
+
+    G = stage("walk graph", lambda: prepare_walk_graph(G, SyntheticTerrain(), timings=timings))
+
+    def grades():
+        colormap = cm.LinearColormap(["yellow", "orange", 'red', 'purple', 'blue'], vmin=0, vmax=0.15)
+        layer = grade_layer(ox.graph_to_gdfs(G, nodes=False), colormap)
+        layer.add_to(m)
+        return layer
+    stage("grade layer", grades)
+
+    travel = stage("shortest paths", lambda: travel_costs(G, lat, lon, radius, "walk time"))
+
+    def isochrone():
+        layer = isochrone_layer(isochrones(G, travel["cost"], travel["limits"], weight=travel["weight"]), iso_minutes)
+        layer.add_to(m)
+        return layer
+    stage("isochrones", isochrone)
+
+    if pois:
+        def points():
+            p4326 = poi_points(features, tags)
+            poi_layer(p4326).add_to(m)
+            return p4326
+        p4326 = stage("poi points", points)
+
+        def nearest():
+            _, routes = nearest_pois(G, p4326, pois, travel)
+            layer = folium.FeatureGroup(name="Routes to nearest PoI")
+            for route_gdf, color, tooltip in routes:
+                folium.GeoJson(route_gdf[["geometry"]], tooltip=tooltip).add_to(layer)
+            layer.add_to(m)
+            return layer
+        stage("nearest pois", nearest)
+
+    folium.LayerControl().add_to(m)
+    stage("map render", lambda: m.get_root().render())
+    for name, seconds in timings.items():
+        stats[name] = (seconds, None, None)
+    return stats
+
+
+def measure(scenario, recorded, center, repeat):
+    runs = [run(scenario, recorded, center) for _ in range(repeat)]
+    tracemalloc.start()
+    try:
+        traced = run(scenario, recorded, center, memory=True)
+    finally:
+        tracemalloc.stop()
+    return {name: {"seconds": min(r[name][0] for r in runs),  # best of: least disturbed by other load
+                   "peak_mb": None if traced[name][1] is None else traced[name][1] / 2**20,
+                   "output_kb": None if runs[-1][name][2] is None else runs[-1][name][2] / 1024}
+            for name in runs[-1]}
+
+
+def _fmt(value, spec):
+    return "" if value is None else format(value, spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Go! pipeline against a stored baseline.")
+    parser.add_argument("--radius", type=int, nargs="+", default=RADII)
+    parser.add_argument("--poi", nargs="+", default=list(POI_SELECTIONS), choices=list(POI_SELECTIONS))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per scenario (best of)")
+    parser.add_argument("--threshold", type=float, default=0.5, help="allowed slowdown as a fraction of the baseline")
+    parser.add_argument("--min-ms", type=float, default=5, help="slowdowns smaller than this are noise")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args()
+
+    category_lookups()  # loaded once per process in the app too
+    recorded, lat, lon = recorded_features()
+    baseline = json.loads(args.baseline.read_text())["scenarios"] if args.baseline.exists() and not args.save_baseline else {}
+    print(f"{len(recorded)} recorded features around {lat:.4f}, {lon:.4f}")
+
+    results, regressions = {}, []
+    for radius in args.radius:
+        for selection in args.poi:
+            name = f"r{radius} {selection}"
+            stages = measure({"radius": radius, "pois": POI_SELECTIONS[selection]}, recorded, (lat, lon), args.repeat)
+            results[name] = {stage: round(s["seconds"], 5) for stage, s in stages.items()}
+            print(f"\n{name}: {sum(s['seconds'] for stage, s in stages.items() if s['peak_mb'] is not None) * 1e3:.0f} ms")
+            print(f"  {'stage':<16} {'ms':>9} {'baseline':>9} {'change':>8} {'peak MB':>8} {'out KB':>8}")
+            for stage, s in stages.items():
+                base = baseline.get(name, {}).get(stage)
+                change, note = "", ""
+                if base:
+                    change = f"{s['seconds'] / base - 1:+.0%}"
+                    if s["seconds"] > base * (1 + args.threshold) and (s["seconds"] - base) * 1e3 > args.min_ms:
+                        regressions.append((name, stage, base, s["seconds"]))
+                        note = "  REGRESSION"
+                indent = "  " if s["peak_mb"] is not None else "    "
+                print(f"{indent}{stage:<{18 - len(indent)}} {s['seconds'] * 1e3:>9.1f} {_fmt(base and base * 1e3, '>9.1f'):>9} {change:>8} "
+                      f"{_fmt(s['peak_mb'], '>8.1f'):>8} {_fmt(s['output_kb'], '>8.0f'):>8}{note}")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({"machine": platform.platform(), "python": platform.python_version(),
+                                             "scenarios": results}, indent=1))
+        print(f"\nbaseline written to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} stage(s) slower than the baseline by more than {args.threshold:.0%}:")
+        for name, stage, base, seconds in regressions:
+            print(f"  {name} / {stage}: {base * 1e3:.1f} -> {seconds * 1e3:.1f} ms")
+        sys.exit(1)
+    elif not baseline:
+        print("\nno baseline to compare with; record one with --save-baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import requests
+import requests.adapters
+
+
+OPENTOPODATA_URL = "https://api.opentopodata.org/v1/srtm90m"
+batch_size = 100  # OpenTopoData can only take limited locations per request
+
+# Directory with local DEM tiles (SRTM .hgt and/or GeoTIFF); used before the web API when present
+DEM_DIR = os.environ.get("NAVIGATOR_DEM_DIR", "dem")
+# On-disk cache of remote elevations
+ELEVATION_CACHE = os.environ.get("NAVIGATOR_ELEVATION_CACHE", "elevation_cache.sqlite")
+
+
+# Providers -------------------------------------------------------------------------------
+# Every provider has elevations(lats, lons, progress_bar=None, stats=None) -> float array,
+# NaN where unknown. `stats` is an optional dict the provider adds its counters to.
+
+class OpenTopoData:
+    """Web API backend (srtm90m), queried in batches of `batch_size` locations.
+
+    Batches are sent from a small thread pool over one pooled session, paced by a token
+    bucket set to the API quota (the public server allows 1 call per second). 429 and 5xx
+    responses are retried with exponential backoff, honouring Retry-After; points whose
+    batch still fails come back as NaN and are counted as `remote_failed`.
+    """
+
+    def __init__(self, url=OPENTOPODATA_URL, calls_per_second=1.0, burst=1, max_workers=4, max_retries=4):
+        self.url = url
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self._limiter = _TokenBucket(calls_per_second, burst)
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def _fetch_batch(self, batch):
+        locations = "|".join([f"{lat},{lon}" for lat, lon in batch])
+        for attempt in range(self.max_retries + 1):
+            self._limiter.acquire()
+            try:
+                r = self._session.get(self.url, params={"locations": locations}, timeout=30)
+            except requests.RequestException:
+                r = None
+            if r is not None and r.status_code == 200:
+                results = r.json().get('results', [])
+                return [res.get('elevation', None) for res in results]
+            retryable = r is None or r.status_code == 429 or r.status_code >= 500
+            if not retryable or attempt == self.max_retries:
+                break
+            retry_after = r.headers.get("Retry-After") if r is not None else None
+            time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt)
+        return [None]*len(batch)
+
+    def elevations(self, lats, lons, progress_bar=None, stats=None, progress_text="Fetching elevation data..."):
+        coords = list(zip(lats, lons))
+        _count(stats, "remote_points", len(coords))
+        batches = [coords[i:i+batch_size] for i in range(0, len(coords), batch_size)]
+        results = [None]*len(batches)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self._fetch_batch, batch): i for i, batch in enumerate(batches)}
+            # progress is reported from this (the calling) thread, as Streamlit elements require
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                if progress_bar is not None:
+                    progress_pct = int(done / len(batches) * 100)
+                    progress_bar.progress(progress_pct, text=f"{progress_text} ({progress_pct}%)")
+
+        elevations = [e for batch in results for e in batch]
+        elevations = pd.to_numeric(pd.Series(elevations, dtype=object), errors="coerce").to_numpy(dtype=float)
+        _count(stats, "remote_failed", int(np.isnan(elevations).sum()))
+        return elevations
+
+
+class _TokenBucket:
+    # thread-safe token bucket: `rate` tokens per second, at most `capacity` saved up
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SRTMTiles:
+    """Local SRTM .hgt tiles (e.g. N59E017.hgt), memory-mapped and sampled bilinearly.
+
+    Only the pages under the requested points are read from disk, so a query touches a
+    few kilobytes of each 25 MB tile.
+    """
+
+    def __init__(self, directory=DEM_DIR):
+        self.directory = Path(directory)
+        self._tiles = {}
+
+    @staticmethod
+    def tile_name(lat_floor, lon_floor):
+        return f"{'N' if lat_floor >= 0 else 'S'}{abs(lat_floor):02d}{'E' if lon_floor >= 0 else 'W'}{abs(lon_floor):03d}.hgt"
+
+    def _tile(self, lat_floor, lon_floor):
+        key = (lat_floor, lon_floor)
+        if key not in self._tiles:
+            path = self.directory / self.tile_name(lat_floor, lon_floor)
+            if path.exists():
+                size = int(math.isqrt(path.stat().st_size // 2))  # 1201 (3") or 3601 (1") samples per side
+                self._tiles[key] = np.memmap(path, dtype=">i2", mode="r", shape=(size, size))
+            else:
+                self._tiles[key] = None
+        return self._tiles[key]
+
+    def elevations(self, lats, lons, progress_bar=None, stats=None):
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        out = np.full(len(lats), np.nan)
+        lat_floor = np.floor(lats).astype(int)
+        lon_floor = np.floor(lons).astype(int)
+
+        for la, lo in set(zip(lat_floor.tolist(), lon_floor.tolist())):
+            tile = self._tile(la, lo)
+            if tile is None:
+                continue
+            sel = (lat_floor == la) & (lon_floor == lo)
+            # row 0 is the north edge of the tile, column 0 the west edge
+            out[sel] = _bilinear(tile, (la + 1 - lats[sel]) * (tile.shape[0] - 1), (lons[sel] - lo) * (tile.shape[1] - 1), nodata=-32768)
+        _count(stats, "local_points", int((~np.isnan(out)).sum()))
+        return out
+
+
+class GeoTiffDEM:
+    """Local GeoTIFF DEM read with rasterio; only the window covering the points is read."""
+
+    def __init__(self, path, band=1):
+        self.path = path
+        self.band = band
+
+    def elevations(self, lats, lons, progress_bar=None, stats=None):
+        try:
+            import rasterio
+            from rasterio.windows import Window
+        except ImportError as e:
+            raise ImportError("rasterio must be installed to read GeoTIFF elevation rasters.") from e
+
+        xs = np.asarray(lons, dtype=float)
+        ys = np.asarray(lats, dtype=float)
+        out = np.full(len(xs), np.nan)
+        with rasterio.open(self.path) as src:
+            if src.crs is not None and not src.crs.is_geographic:
+                from pyproj import Transformer
+                xs, ys = Transformer.from_crs(4326, src.crs, always_xy=True).transform(xs, ys)
+            # fractional pixel coordinates of cell centers
+            cols, rows = ~src.transform * (xs, ys)
+            rows, cols = np.asarray(rows) - 0.5, np.asarray(cols) - 0.5
+            inside = (rows >= 0) & (cols >= 0) & (rows <= src.height - 1) & (cols <= src.width - 1)
+            if not inside.any():
+                return out
+            row0, col0 = int(np.floor(rows[inside].min())), int(np.floor(cols[inside].min()))
+            row1 = min(int(np.floor(rows[inside].max())) + 2, src.height)
+            col1 = min(int(np.floor(cols[inside].max())) + 2, src.width)
+            window = src.read(self.band, window=Window(col0, row0, col1 - col0, row1 - row0))
+            out[inside] = _bilinear(window, rows[inside] - row0, cols[inside] - col0, nodata=src.nodata)
+        _count(stats, "local_points", int((~np.isnan(out)).sum()))
+        return out
+
+
+class FallbackElevation:
+    """Asks each provider in turn for the points the previous ones could not answer."""
+
+    def __init__(self, providers):
+        self.providers = list(providers)
+
+    def elevations(self, lats, lons, progress_bar=None, stats=None):
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        out = np.full(len(lats), np.nan)
+        for provider in self.providers:
+            missing = np.isnan(out)
+            if not missing.any():
+                break
+            out[missing] = provider.elevations(lats[missing], lons[missing], progress_bar=progress_bar, stats=stats)
+        return out
+
+
+class CachedElevation:
+    """Persistent SQLite cache in front of another (remote) provider.
+
+    Elevations are cached per post of the DEM grid (3 arc-seconds, ~90 m, for srtm90m):
+    the wrapped provider is only asked for the posts around the points that are not
+    cached yet, once per post, and each point is interpolated bilinearly from its four
+    surrounding posts as the API does. Hits (points whose posts were all cached) and
+    misses are added to `stats` and to running totals stored in the database.
+    """
+
+    def __init__(self, provider, path=ELEVATION_CACHE, resolution=3 / 3600):
+        self.provider = provider
+        self.path = path
+        self.resolution = resolution
+        self._n_lon = int(round(360 / resolution) + 1)  # posts per row of the global grid
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")  # several app workers can share the file
+            con.execute("CREATE TABLE IF NOT EXISTS elevation (cell INTEGER PRIMARY KEY, elevation REAL)")
+            con.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:  # commit on success
+                yield con
+        finally:
+            con.close()
+
+    def _grid(self, lats, lons):
+        # fractional (row, col) of each point on the global post grid
+        return ((np.asarray(lats, dtype=float) + 90) / self.resolution,
+                (np.asarray(lons, dtype=float) + 180) / self.resolution)
+
+    def _cell_centers(self, cells):
+        # (lat, lon) of posts given by their row-major index over the global grid
+        return (cells // self._n_lon) * self.resolution - 90, (cells % self._n_lon) * self.resolution - 180
+
+    def elevations(self, lats, lons, progress_bar=None, stats=None):
+        rows, cols = self._grid(lats, lons)
+        if not len(rows):
+            return np.full(0, np.nan)
+        r0, c0 = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+        # the four posts around each point, as indexes over the global grid
+        corners = np.stack([(r0 + dr) * self._n_lon + c0 + dc for dr in (0, 1) for dc in (0, 1)])
+        unique_cells = np.unique(corners)
+
+        cached = {}
+        with self._connect() as con:
+            for i in range(0, len(unique_cells), 500):  # stay below SQLite's host parameter limit
+                chunk = unique_cells[i:i+500].tolist()
+                cached.update(con.execute(f"SELECT cell, elevation FROM elevation WHERE cell IN ({','.join('?'*len(chunk))})", chunk).fetchall())
+
+        missing = np.array([c for c in unique_cells.tolist() if c not in cached], dtype=np.int64)
+        if len(missing):
+            fetched = self.provider.elevations(*self._cell_centers(missing), progress_bar=progress_bar, stats=stats)
+            found = ~np.isnan(fetched)
+            cached.update(zip(missing.tolist(), fetched.tolist()))
+            with self._connect() as con:
+                con.executemany("INSERT OR REPLACE INTO elevation VALUES (?, ?)", zip(missing[found].tolist(), fetched[found].tolist()))
+
+        hits = int((~np.isin(corners, missing)).all(axis=0).sum())
+        misses = len(rows) - hits
+        _count(stats, "cache_hits", hits)
+        _count(stats, "cache_misses", misses)
+        with self._connect() as con:
+            con.executemany("INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", [("hits", hits), ("misses", misses)])
+
+        # the posts as a small local grid (NaN where no post is needed or none is known)
+        row_min, col_min = r0.min(), c0.min()
+        grid = np.full((r0.max() - row_min + 2, c0.max() - col_min + 2), np.nan)
+        grid[unique_cells // self._n_lon - row_min, unique_cells % self._n_lon - col_min] = [cached.get(c, np.nan) for c in unique_cells.tolist()]
+        return _bilinear(grid, rows - row_min, cols - col_min)
+
+    def totals(self):
+        """Hits and misses accumulated by every process using this cache file."""
+        with self._connect() as con:
+            return dict(con.execute("SELECT name, value FROM stats").fetchall())
+
+
+def _bilinear(grid, rows, cols, nodata=None):
+    # interpolate grid at fractional (row, col); reads only the four neighbouring cells per point
+    r0 = np.clip(np.floor(rows).astype(int), 0, grid.shape[0] - 2)
+    c0 = np.clip(np.floor(cols).astype(int), 0, grid.shape[1] - 2)
+    dr, dc = rows - r0, cols - c0
+    corners = np.stack([grid[r0, c0], grid[r0, c0 + 1], grid[r0 + 1, c0], grid[r0 + 1, c0 + 1]]).astype(float)
+    if nodata is not None:
+        corners[corners == nodata] = np.nan
+    weights = np.stack([(1 - dr) * (1 - dc), (1 - dr) * dc, dr * (1 - dc), dr * dc])
+    # a void corner only spoils the points it contributes to (not those exactly on a sample or cell edge)
+    return np.where(weights > 0, corners * weights, 0).sum(axis=0)
+
+
+def _count(stats, name, n):
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + n
+
+
+@lru_cache(maxsize=None)
+def default_provider():
+    """Local tiles from DEM_DIR (when the directory exists), with the cached web API as fallback."""
+    providers = []
+    dem_dir = Path(DEM_DIR)
+    if dem_dir.is_dir():
+        providers.append(SRTMTiles(dem_dir))
+        providers.extend(GeoTiffDEM(p) for p in sorted(dem_dir.glob("*.tif")))
+    providers.append(CachedElevation(OpenTopoData()))
+    return FallbackElevation(providers)
+
+
+# Graph -------------------------------------------------------------------------------------
+
+def add_node_elevations(G, provider=None, progress_bar=None, stats=None):
+    """Attach an `elevation` attribute to every node of G (in place) and return G.
+
+    The number of points and the provider counters (cache hits/misses, local and remote
+    points) are added to `stats`.
+    """
+    provider = provider or default_provider()
+    nodes = _nodes_xy(G)
+
+    stats = {} if stats is None else stats
+    stats["points"] = stats.get("points", 0) + len(nodes)
+    elevations = pd.Series(provider.elevations(nodes.y.to_numpy(), nodes.x.to_numpy(), progress_bar=progress_bar, stats=stats), index=nodes.index)
+
+    # Replace None or NaN with median (fallback)
+    elevations = elevations.fillna(elevations.median())
+
+    for node_id, elev in elevations.items():
+        G.nodes[node_id]["elevation"] = elev
+    return G
+
+
+def _nodes_xy(G):
+    # plain x/y frame of the graph nodes, cheaper than ox.graph_to_gdfs (no geometries)
+    return pd.DataFrame.from_dict(dict(G.nodes(data=True)), orient="index")[["y", "x"]]
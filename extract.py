@@ -0,0 +1,272 @@
+"""Regional extract mode: answer radius queries from a local OSM extract instead of Overpass.
+
+A one-time ingest reads an .osm.pbf or .osm XML file for a city or country (in one
+streamed pass with pyosmium, which .osm.pbf files need) and writes to a directory:
+
+- features.parquet: every feature carrying one of FEATURE_KEYS (tags + geometry),
+- walk.pkl: the walk network, filtered with the same rules OSMnx sends to Overpass,
+- meta.json: bounds, source file and ingest settings.
+
+    python extract.py stockholm.osm.pbf extracts/stockholm
+
+Point the app at it with NAVIGATOR_EXTRACT=extracts/stockholm. Queries inside the
+extract's bounds are then served from it; anything outside still goes to Overpass.
+"""
+import argparse
+import json
+import os
+import pickle
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import osmnx._overpass
+import osmnx.graph
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyproj
+import shapely
+from osmnx._errors import InsufficientResponseError
+
+from features import select_features
+
+
+# tag keys used by the land-use pie and the PoI pills (see OSM features.xls)
+FEATURE_KEYS = ["landuse", "natural", "leisure", "amenity", "building", "shop", "railway", "public_transport"]
+
+_FILTER = re.compile(r'\["([^"]+)"(?:(!?~)"([^"]*)")?\]')
+
+
+def _way_filter(network_type="walk"):
+    # OSMnx's Overpass filter for the network type as a predicate on way tags
+    conditions = [(key, op, re.compile(regex) if op else None) for key, op, regex in _FILTER.findall(osmnx._overpass._get_network_filter(network_type))]
+
+    def keep(tags):
+        for key, op, regex in conditions:
+            value = tags.get(key)
+            if not op:
+                if value is None:
+                    return False
+            elif op == "~":
+                if value is None or not regex.search(str(value)):
+                    return False
+            elif value is not None and regex.search(str(value)):
+                return False
+        return True
+    return keep, sorted({key for key, _, _ in conditions})
+
+
+@contextmanager
+def _way_tags(extra):
+    # OSMnx copies only settings.useful_tags_way onto the edges; the walk filter needs more
+    useful_tags_way = ox.settings.useful_tags_way
+    ox.settings.useful_tags_way = sorted(set(useful_tags_way) | set(extra))
+    try:
+        yield
+    finally:
+        ox.settings.useful_tags_way = useful_tags_way
+
+
+class _FeatureWriter:
+    # features.parquet written in batches, as GeoParquet that gpd.read_parquet loads
+    def __init__(self, path, keys, batch_size=100_000):
+        self.columns = ["name", *[key for key in keys if key != "name"]]
+        geo = {"version": "1.0.0", "primary_column": "geometry",
+               "columns": {"geometry": {"encoding": "WKB", "geometry_types": [], "crs": pyproj.CRS(4326).to_json_dict()}}}
+        self.schema = pa.schema([("element", pa.string()), ("id", pa.int64()), *[(c, pa.string()) for c in self.columns],
+                                 ("geometry", pa.binary())], metadata={"geo": json.dumps(geo)})
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.batch_size = batch_size
+        self.rows, self.count, self.bounds = [], 0, None
+
+    def add(self, element, osm_id, tags, geometry):
+        self.rows.append((element, osm_id, *[tags.get(c) for c in self.columns], geometry))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = list(zip(*self.rows))
+        geometries = np.array(columns[-1], dtype=object)
+        bounds = shapely.total_bounds(geometries)
+        self.bounds = bounds if self.bounds is None else np.r_[np.minimum(self.bounds[:2], bounds[:2]), np.maximum(self.bounds[2:], bounds[2:])]
+        self.writer.write_table(pa.Table.from_arrays([*map(pa.array, columns[:-1]), pa.array(shapely.to_wkb(geometries))], schema=self.schema))
+        self.count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def _read_osmium(source, keys, features_path):
+    # one streamed pass with pyosmium: features with one of `keys` go to features_path in
+    # batches; only the walkable ways and their nodes are held in memory for the graph
+    import osmium
+
+    keep, filter_keys = _way_filter("walk")
+    node_tags = set(ox.settings.useful_tags_node)
+    wkb = osmium.geom.WKBFactory()
+    features = _FeatureWriter(features_path, keys)
+    nodes, ways, tagged = {}, [], {}
+    with tempfile.TemporaryDirectory() as workdir:
+        # node locations in a file rather than in memory: country extracts have hundreds of millions
+        reader = (osmium.FileProcessor(str(source))
+                  .with_locations(f"sparse_file_array,{Path(workdir) / 'locations'}")
+                  .with_areas(osmium.filter.KeyFilter(*keys))
+                  .with_filter(osmium.filter.KeyFilter(*keys, "highway", *node_tags)))
+        for obj in reader:
+            tags = dict(obj.tags)
+            is_feature = any(key in tags for key in keys)
+            if obj.is_node():
+                if is_feature:
+                    features.add("node", obj.id, tags, shapely.from_wkb(wkb.create_point(obj)))
+                if node_tags & tags.keys():
+                    tagged[obj.id] = tags
+            elif obj.is_way():
+                if "highway" in tags and keep(tags):
+                    refs = [n.ref for n in obj.nodes if n.location.valid()]
+                    nodes.update((n.ref, (n.lat, n.lon)) for n in obj.nodes if n.location.valid())
+                    ways.append({"type": "way", "id": obj.id, "nodes": refs, "tags": tags})
+                # closed ways come back as areas, unless tagged as lines
+                if is_feature and (not obj.is_closed() or tags.get("area") == "no") and len(obj.nodes) > 1:
+                    features.add("way", obj.id, tags, shapely.from_wkb(wkb.create_linestring(obj)))
+            elif obj.is_area() and is_feature:
+                geometry = shapely.from_wkb(wkb.create_multipolygon(obj))
+                if len(geometry.geoms) == 1:  # a Polygon, as OSMnx returns it
+                    geometry = geometry.geoms[0]
+                features.add("way" if obj.from_way() else "relation", obj.orig_id(), tags, geometry)
+    features.close()
+
+    elements = [{"type": "node", "id": n, "lat": lat, "lon": lon, "tags": tagged.get(n, {})} for n, (lat, lon) in nodes.items()]
+    with _way_tags(filter_keys):
+        G = osmnx.graph._create_graph([{"elements": elements + ways}], bidirectional=True)
+    return features.count, features.bounds, G
+
+
+def _read_xml(source, keys, features_path):
+    # .osm XML without pyosmium: OSMnx parses the file, once for the features and once for the graph
+    features = ox.features_from_xml(source, tags={key: True for key in keys}).reset_index()
+    features = features[[c for c in ["element", "id", "name", *keys, "geometry"] if c in features.columns]]
+    features.to_parquet(features_path)
+
+    keep, filter_keys = _way_filter("walk")
+    with _way_tags(filter_keys):
+        G = ox.graph_from_xml(source, bidirectional=True, simplify=False, retain_all=True)
+    G.remove_edges_from([(u, v, k) for u, v, k, d in G.edges(keys=True, data=True) if not keep(d)])
+    return len(features), features.total_bounds if len(features) else None, G
+
+
+def ingest(source, out_dir, keys=FEATURE_KEYS):
+    """Build the feature store and walk network of a regional extract from an OSM file.
+
+    With pyosmium installed the file is read in one streamed pass, which keeps memory
+    bounded for country extracts; without it only .osm XML files can be read.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        import osmium  # noqa: F401
+    except ImportError:
+        if Path(source).suffix == ".pbf":
+            raise ImportError("pyosmium must be installed to read .osm.pbf extracts (or convert them to .osm first).") from None
+        read = _read_xml
+    else:
+        read = _read_osmium
+    n_features, feature_bounds, G = read(source, keys, out_dir / "features.parquet")
+
+    G.remove_nodes_from(list(nx.isolates(G)))
+    G = ox.simplify_graph(G)
+    with open(out_dir / "walk.pkl", "wb") as f:
+        pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    xy = np.array([(d["x"], d["y"]) for _, d in G.nodes(data=True)]).reshape(-1, 2)
+    if feature_bounds is not None:
+        xy = np.vstack([xy, np.reshape(feature_bounds, (2, 2))])
+    bounds = [*xy.min(axis=0).tolist(), *xy.max(axis=0).tolist()]
+    meta = {"source": str(source), "created": time.time(), "keys": list(keys), "bounds": bounds,
+            "features": n_features, "nodes": len(G), "edges": G.number_of_edges()}
+    (out_dir / "meta.json").write_text(json.dumps(meta, indent=2))
+    return meta
+
+
+class RegionalExtract:
+    """Radius queries against an ingested extract; data is loaded on first use."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.meta = json.loads((self.directory / "meta.json").read_text())
+
+    def covers(self, lat, lon, dist, tags=None):
+        west, south, east, north = ox.utils_geo.bbox_from_point((lat, lon), dist=dist)
+        b = self.meta["bounds"]
+        return (b[0] <= west and b[1] <= south and b[2] >= east and b[3] >= north
+                and (tags is None or set(tags) <= set(self.meta["keys"])))
+
+    @property
+    def features(self):
+        if not hasattr(self, "_features"):
+            features = gpd.read_parquet(self.directory / "features.parquet").set_index(["element", "id"])
+            features.sindex  # build the spatial index once
+            self._features = features
+        return self._features
+
+    @property
+    def graph(self):
+        if not hasattr(self, "_graph"):
+            with open(self.directory / "walk.pkl", "rb") as f:
+                self._graph = pickle.load(f)
+            nodes = list(self._graph.nodes(data=True))
+            self._node_ids = np.array([n for n, _ in nodes])
+            self._node_index = shapely.STRtree(shapely.points([(d["x"], d["y"]) for _, d in nodes]))
+        return self._graph
+
+    def features_from_point(self, lat, lon, tags, dist):
+        """Same result as ox.features_from_point on the extract's data."""
+        bbox = ox.utils_geo.bbox_from_point((lat, lon), dist=dist)
+        features = self.features
+        found = features.iloc[np.sort(features.sindex.query(ox.utils_geo.bbox_to_poly(bbox), predicate="intersects"))]
+        found = select_features(found, tags)
+        if found.empty:
+            raise InsufficientResponseError("No matching features in the regional extract.")
+        return found.dropna(axis=1, how="all")
+
+    def graph_from_point(self, lat, lon, dist):
+        """Walk network in the bbox of `dist` around the point, largest weakly connected component."""
+        G = self.graph
+        bbox = ox.utils_geo.bbox_from_point((lat, lon), dist=dist)
+        inside = self._node_ids[np.sort(self._node_index.query(shapely.box(*bbox)))]
+        if len(inside) == 0:
+            raise InsufficientResponseError("No walk network in the regional extract around this point.")
+        return ox.truncate.largest_component(G.subgraph(inside.tolist()).copy())
+
+
+@lru_cache(maxsize=None)
+def _load(directory):
+    return RegionalExtract(directory)
+
+
+def extract_for(lat, lon, dist, tags=None):
+    """The extract configured with NAVIGATOR_EXTRACT if it covers this query, else None."""
+    directory = os.environ.get("NAVIGATOR_EXTRACT")
+    if not directory:
+        return None
+    region = _load(directory)
+    return region if region.covers(lat, lon, dist, tags) else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest an OSM extract (.osm.pbf or .osm) for offline queries.")
+    parser.add_argument("source")
+    parser.add_argument("out_dir")
+    parser.add_argument("--keys", nargs="+", default=FEATURE_KEYS, help="feature tag keys to keep")
+    args = parser.parse_args()
+    print(json.dumps(ingest(args.source, args.out_dir, args.keys), indent=2))
@@ -0,0 +1,190 @@
+import os
+import threading
+from collections import OrderedDict
+
+import geopandas as gpd
+import numpy as np
+import osmnx as ox
+import pandas as pd
+import shapely
+
+
+# Overpass tag filters are dicts like {"landuse": True, "amenity": ["school", "cafe"]}:
+# True matches any value of the key, a string or list matches those values only.
+
+def merge_tags(*tag_dicts):
+    """Union of several tag filters, so one Overpass query returns what each of them needs."""
+    merged = {}
+    for tags in tag_dicts:
+        for key, values in (tags or {}).items():
+            if merged.get(key) is True or values is True:
+                merged[key] = True
+            else:
+                values = [values] if isinstance(values, str) else list(values)
+                merged[key] = list(dict.fromkeys(merged.get(key, []) + values))
+    return merged
+
+
+def select_features(gdf, tags):
+    """Rows of `gdf` matching the tag filter `tags`, as if it had been queried on its own."""
+    mask = pd.Series(False, index=gdf.index)
+    for key, values in tags.items():
+        if key not in gdf.columns:
+            continue
+        if values is True:
+            mask |= gdf[key].notna()
+        else:
+            mask |= gdf[key].isin([values] if isinstance(values, str) else list(values))
+    return gdf[mask]
+
+
+def melt_tags(gdf, tag_keys, keep=()):
+    """Long (id, key, value, geometry) frame with one row per tag of `tag_keys` present on a feature.
+
+    Built positionally from the tag matrix, so geometries are gathered once and nothing
+    is merged back on `id`. Columns in `keep` (e.g. name) are carried along the same way.
+    """
+    # keep onlt keys that exist in gdf
+    tag_keys = [k for k in tag_keys if k in gdf.columns]
+    if not tag_keys:
+        raise ValueError("None of the provided tag_keys exist in the GeoDataFrame.")
+
+    values = gdf[tag_keys].to_numpy(dtype=object)
+    rows, cols = np.nonzero(pd.notna(values))  # row-major, same order as DataFrame.stack
+    ids = gdf.index.get_level_values("id") if "id" in gdf.index.names else gdf.index
+    data = {"id": ids.to_numpy()[rows], "key": np.asarray(tag_keys, dtype=object)[cols], "value": values[rows, cols]}
+    for col in keep:
+        data[col] = gdf[col].to_numpy()[rows] if col in gdf.columns else None
+    return gpd.GeoDataFrame(data, geometry=gdf.geometry.values.take(rows), crs=gdf.crs)
+
+
+class TagLookup:
+    """(key, value) -> attribute lookup (pie category, PoI category, ...) applied by integer code.
+
+    Keys and values of the table are indexed once, with a dense key x value array of
+    table rows. A query factorizes the melted keys and values against those indexes and
+    reads the row codes from the array, then gathers the attribute columns positionally
+    instead of merging DataFrames. Duplicate pairs in the table keep their first row.
+    """
+
+    def __init__(self, table, columns):
+        table = table.drop_duplicates(["key", "value"])
+        # plain object arrays: no per-query conversion from pandas' arrow-backed strings
+        self.keys = pd.Index(table["key"].unique(), dtype=object)
+        self.values = pd.Index(table["value"].unique(), dtype=object)
+        self.rows = np.full((len(self.keys), len(self.values)), -1, dtype=np.int64)
+        self.rows[self.keys.get_indexer(table["key"]), self.values.get_indexer(table["value"])] = np.arange(len(table))
+        self.columns = {col: table[col].to_numpy(dtype=object) for col in columns}
+
+    def codes(self, keys, values):
+        """Row code of every (key, value) pair, -1 where the pair is not in the table."""
+        k = self.keys.get_indexer(np.asarray(keys, dtype=object))
+        v = self.values.get_indexer(np.asarray(values, dtype=object))
+        known = (k >= 0) & (v >= 0)
+        codes = np.full(len(k), -1, dtype=np.int64)
+        codes[known] = self.rows[k[known], v[known]]
+        return codes
+
+    def join(self, melted):
+        """Rows of `melted` whose (key, value) is in the table, with the table's columns added."""
+        codes = self.codes(melted["key"], melted["value"])
+        rows = np.flatnonzero(codes >= 0)
+        geometry = melted.geometry.name
+        data = {col: melted[col].to_numpy()[rows] for col in melted.columns if col != geometry}
+        for col, values in self.columns.items():
+            data[col] = values[codes[rows]]
+        return gpd.GeoDataFrame(data, geometry=melted.geometry.values.take(rows), crs=melted.crs)
+
+
+def tags_contain(tags, subset):
+    """True if every feature matched by the filter `subset` is also matched by `tags`."""
+    for key, values in subset.items():
+        held = tags.get(key)
+        if held is True:
+            continue
+        if held is None or values is True:
+            return False
+        held = {held} if isinstance(held, str) else set(held)
+        if not ({values} if isinstance(values, str) else set(values)) <= held:
+            return False
+    return True
+
+
+def _bbox_contains(outer, inner):
+    # bboxes are (left, bottom, right, top) as returned by ox.utils_geo.bbox_from_point
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+
+def _frame_bytes(gdf):
+    # pandas' deep memory usage does not see inside shapely geometries; count their coordinates
+    return int(gdf.drop(columns=gdf.geometry.name).memory_usage(deep=True).sum()
+               + shapely.get_num_coordinates(gdf.geometry.to_numpy()).sum() * 16 + len(gdf) * 100)
+
+
+class FeatureCache:
+    """In-memory cache of Overpass feature queries that answers contained requests locally.
+
+    ox.features_from_point queries the bbox of `dist` meters around the point. Each entry
+    remembers that bbox and its tag filter; a request whose bbox and tags are both covered
+    by an entry is answered by cutting the cached GeoDataFrame to the requested bbox and
+    tags, which gives the same rows a fresh query would. Entries are evicted least recently
+    used first once their estimated size exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=int(os.environ.get("NAVIGATOR_FEATURE_CACHE_MB", 256)) * 2**20):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (bbox, tags, gdf, nbytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, bbox, tags):
+        with self._lock:
+            for key, (held_bbox, held_tags, gdf, _) in reversed(self._entries.items()):
+                if _bbox_contains(held_bbox, bbox) and tags_contain(held_tags, tags):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return held_bbox, held_tags, gdf
+            self.misses += 1
+            return None
+
+    def _store(self, bbox, tags, gdf):
+        with self._lock:
+            # drop entries the new one supersedes
+            for key in [k for k, (b, t, _, _) in self._entries.items() if _bbox_contains(bbox, b) and tags_contain(tags, t)]:
+                del self._entries[key]
+            self._entries[(bbox, repr(sorted(tags.items())))] = (bbox, tags, gdf, _frame_bytes(gdf))
+            while len(self._entries) > 1 and sum(e[3] for e in self._entries.values()) > self.max_bytes:
+                self._entries.popitem(last=False)
+
+    def get(self, lat, lon, tags, dist, fetch=None):
+        """Features within `dist` of (lat, lon) matching `tags`; `fetch` is called on a miss."""
+        bbox = ox.utils_geo.bbox_from_point((lat, lon), dist=dist)
+        found = self._lookup(bbox, tags)
+        if found is None:
+            gdf = (fetch or _fetch_features)(lat, lon, tags, dist)
+            self._store(bbox, tags, gdf)
+            return gdf
+        held_bbox, held_tags, gdf = found
+        if held_bbox != bbox:
+            gdf = gdf.iloc[np.sort(gdf.sindex.query(ox.utils_geo.bbox_to_poly(bbox), predicate="intersects"))]
+        if held_tags != tags:
+            gdf = select_features(gdf, tags)
+        return gdf
+
+    def info(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": sum(e[3] for e in self._entries.values()),
+                    "hits": self.hits, "misses": self.misses}
+
+
+def _fetch_features(lat, lon, tags, dist):
+    from extract import extract_for  # extract imports this module
+    region = extract_for(lat, lon, dist, tags)
+    if region is not None:
+        return region.features_from_point(lat, lon, tags, dist)
+    return ox.features_from_point((lat, lon), tags=tags, dist=dist)
+
+
+# shared by all sessions of the app process
+feature_cache = FeatureCache()
@@ -0,0 +1,171 @@
+"""Stage timings and counters of one query, for the app's debug panel and a JSON-lines log.
+
+A Trace collects seconds per named stage (the same {stage: seconds} dict the land-use
+and graph functions fill through their `timings` argument), counts such as features,
+nodes and edges, and how much watched counters (cache hits, bytes downloaded) grew
+during the query. finish() appends one JSON object per query to TRACE_LOG, so latency
+percentiles can be aggregated across traffic:
+
+    python instrument.py                  # percentiles per stage of traces.jsonl
+    python instrument.py other.jsonl
+
+Set NAVIGATOR_PROFILE=cprofile (or pyinstrument, if installed) to profile each query;
+the report is kept on the trace and shown in the debug panel. Work the query hands to
+other threads is profiled through Trace.thread_profile().
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+
+
+TRACE_LOG = os.environ.get("NAVIGATOR_TRACE_LOG", "traces.jsonl")  # empty: no log
+PROFILER = os.environ.get("NAVIGATOR_PROFILE", "")  # "", "cprofile" or "pyinstrument"
+
+_log_lock = threading.Lock()
+
+
+class Trace:
+    """Timings, counts and (optionally) a profile of one query; `context` goes into the record as is."""
+
+    def __init__(self, kind="query", profiler=PROFILER, **context):
+        self.kind = kind
+        self.context = context
+        self.timings = {}
+        self.counts = {}
+        self.profile = None
+        self._watched = {}
+        self._started = time.time()
+        self._t0 = time.perf_counter()
+        self._profiler = None
+        self._thread = threading.get_ident()
+        self._thread_profilers = []  # of blocks run on other threads, see thread_profile()
+        if profiler == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError as e:
+                raise ImportError("pyinstrument must be installed for NAVIGATOR_PROFILE=pyinstrument.") from e
+            self._profiler = Profiler()
+            self._profiler.start()
+        elif profiler:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    @contextmanager
+    def stage(self, name):
+        """Time the block as stage `name` (added up if the stage runs more than once)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - t0
+
+    @contextmanager
+    def thread_profile(self):
+        """Profile the block if the trace profiles and it runs on another thread.
+
+        A profiler only sees the thread that started it, so work handed to a pool (tasks.py)
+        gets a profiler of its own; finish() merges them into the report.
+        """
+        if self._profiler is None or threading.get_ident() == self._thread:
+            yield
+            return
+        if isinstance(self._profiler, cProfile.Profile):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = type(self._profiler)()
+            profiler.start()
+        try:
+            yield
+        finally:
+            if isinstance(profiler, cProfile.Profile):
+                profiler.disable()
+            else:
+                profiler.stop()
+            with _log_lock:
+                self._thread_profilers.append(profiler)
+
+    def add(self, timings):
+        """Add a {stage: seconds} dict filled elsewhere."""
+        for name, seconds in timings.items():
+            self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def count(self, **counts):
+        self.counts.update(counts)
+
+    def watch(self, name, counters):
+        """Report the growth of `counters()` (a dict of numbers) over the query as name_<key> counts."""
+        self._watched[name] = (counters, dict(counters()))
+
+    def finish(self, path=TRACE_LOG):
+        """Stop the profiler, complete the counts and append the record to `path`; returns the record."""
+        total = time.perf_counter() - self._t0
+        if isinstance(self._profiler, cProfile.Profile):
+            self._profiler.disable()
+            out = io.StringIO()
+            stats = pstats.Stats(self._profiler, stream=out)
+            for profiler in self._thread_profilers:
+                stats.add(profiler)
+            stats.sort_stats("cumulative").print_stats(40)
+            self.profile = out.getvalue()
+        elif self._profiler is not None:
+            from pyinstrument.renderers import ConsoleRenderer
+            from pyinstrument.session import Session
+            session = self._profiler.stop()
+            for profiler in self._thread_profilers:
+                session = Session.combine(session, profiler.last_session)
+            self.profile = ConsoleRenderer().render(session)
+        self._profiler = None
+        self._thread_profilers = []
+        for name, (counters, start) in self._watched.items():
+            for key, value in counters().items():
+                if isinstance(value, (int, float)) and key in start:
+                    self.counts[f"{name}_{key}"] = value - start[key]
+        self._watched = {}
+
+        record = {"time": datetime.fromtimestamp(self._started, timezone.utc).isoformat(timespec="seconds"),
+                  "kind": self.kind, **self.context, "total_s": round(total, 4),
+                  "timings": {name: round(seconds, 4) for name, seconds in self.timings.items()},
+                  "counts": self.counts}
+        if path:
+            line = json.dumps(record, ensure_ascii=False, default=str)
+            with _log_lock, open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        return record
+
+
+def read_log(path=TRACE_LOG):
+    """Records of a trace log as a flat frame ("timings <stage>" and "counts <name>" columns)."""
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return pd.json_normalize(records, sep=" ")
+
+
+def percentiles(df, q=(0.5, 0.9, 0.99)):
+    """Count and latency percentiles (seconds) of the total and every stage of read_log records."""
+    stages = df[["total_s"] + [c for c in df.columns if c.startswith("timings ")]]
+    stages = stages.rename(columns=lambda c: c.removeprefix("timings ")).dropna(axis=1, how="all")
+    summary = stages.quantile(list(q)).T
+    summary.columns = [f"p{round(p * 100)}" for p in q]
+    summary.insert(0, "n", stages.notna().sum())
+    return summary.sort_values(summary.columns[-1], ascending=False)
+
+
+if __name__ == "__main__":
+    log = sys.argv[1] if len(sys.argv) > 1 else TRACE_LOG
+    if not Path(log).exists():
+        sys.exit(f"no trace log at {log}")
+    df = read_log(log)
+    for kind, group in df.groupby("kind"):
+        print(f"{kind}: {len(group)} traces")
+        print(percentiles(group).round(3).to_string(), end="\n\n")
@@ -0,0 +1,170 @@
+import time
+from functools import lru_cache
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from shapely.geometry import Point
+
+
+def local_crs(lat, lon):
+    """UTM zone of (lat, lon), the metric CRS used for clipping and areas.
+
+    Same zone as GeoSeries.estimate_utm_crs picks, without its ~130 ms database query.
+    """
+    zone = min(int((lon + 180) // 6), 59) + 1
+    return _crs((32600 if lat >= 0 else 32700) + zone)
+
+
+@lru_cache(maxsize=None)
+def _crs(epsg):
+    return pyproj.CRS.from_epsg(epsg)
+
+
+def clip_to_circle(gdf, lat, lon, radius, crs=None, timings=None):
+    """Parts of `gdf` within `radius` meters of (lat, lon), in `crs` (local UTM by default), with area_m2.
+
+    `gdf` is in EPSG:4326 and only features near the circle are projected, once. A bounding-box test against the circle sorts them into
+    far away (dropped), certainly inside (all four bbox corners within the radius, kept
+    as they are) and the rest, which are tested against the prepared circle and only
+    intersected if they cross it. Seconds spent per stage are added to `timings`.
+    """
+    t0 = time.perf_counter()
+    if gdf.crs is None:
+        gdf = gdf.set_crs(4326)
+    # generous degree bbox first, so features far from the circle are never projected
+    dlat = radius / 111_320 * 1.05 + 1e-6
+    dlon = dlat / max(np.cos(np.radians(abs(lat) + dlat)), 1e-6)
+    x0, y0, x1, y1 = shapely.bounds(gdf.geometry.to_numpy()).T
+    gdf = gdf[(x0 <= lon + dlon) & (x1 >= lon - dlon) & (y0 <= lat + dlat) & (y1 >= lat - dlat)]
+    crs = crs or local_crs(lat, lon)
+    gdf = gdf.to_crs(crs)
+    cx, cy = shapely.get_coordinates(gpd.GeoSeries([Point(lon, lat)], crs=4326).to_crs(crs).iloc[0])[0]
+    circle = Point(cx, cy).buffer(radius)  # same 16 segments per quarter as GeoSeries.buffer
+    shapely.prepare(circle)
+    t1 = time.perf_counter()
+
+    geoms = gdf.geometry.to_numpy()
+    x0, y0, x1, y1 = shapely.bounds(geoms).T
+    near = (x0 <= cx + radius) & (x1 >= cx - radius) & (y0 <= cy + radius) & (y1 >= cy - radius)
+    # if the bbox corner farthest from the center is within the circle, the feature is inside;
+    # the buffer is a 64-gon, so test against its inner radius to agree with clipping exactly
+    inner = radius * np.cos(np.pi / 64)
+    dx = np.maximum(np.abs(x0 - cx), np.abs(x1 - cx))
+    dy = np.maximum(np.abs(y0 - cy), np.abs(y1 - cy))
+    inside = near & (dx * dx + dy * dy < inner * inner)
+    crossing = np.flatnonzero(near & ~inside)
+    crossing = crossing[shapely.intersects(circle, geoms[crossing])]
+    clipped = geoms.copy()
+    clipped[crossing] = shapely.intersection(geoms[crossing], circle)
+    keep = np.flatnonzero(inside)
+    keep = np.sort(np.concatenate([keep, crossing[~shapely.is_empty(clipped[crossing])]]))
+    out = gdf.iloc[keep].copy()
+    out[gdf.geometry.name] = gpd.array.from_shapely(clipped[keep], crs=crs)
+    t2 = time.perf_counter()
+
+    out["area_m2"] = shapely.area(clipped[keep])
+    t3 = time.perf_counter()
+    if timings is not None:
+        for stage, seconds in (("project", t1 - t0), ("clip", t2 - t1), ("area", t3 - t2)):
+            timings[stage] = timings.get(stage, 0) + seconds
+    return out
+
+
+def circle_area(radius):
+    """Area of the polygon clip_to_circle clips with, the total for resolve_overlaps."""
+    return Point(0, 0).buffer(radius).area
+
+
+# pie categories in the order they claim overlapping ground: a building inside a residential
+# area counts as the building, a park over woodland as leisure; unlisted categories come last
+PRIORITY = [
+    "residential buildings", "commercial buildings", "education", "transportation",
+    "leisure", "recreation_ground", "fairground area", "greenery", "trees", "nature",
+    "industrial area", "retail area", "institutional area", "(to be) construction",
+    "agriculture", "other landuse",
+]
+
+
+def _polygons(geoms):
+    # polygonal parts only: clipping can leave lines and points where features touch the circle
+    parts = shapely.get_parts(geoms)
+    return parts[shapely.get_type_id(parts) == 3]
+
+
+def _dissolve(geoms):
+    # union of the polygons that overlap or touch others, in connected groups; the rest as they are
+    if len(geoms) == 0:
+        return geoms
+    a, b = shapely.STRtree(geoms).query(geoms, predicate="intersects")
+    n = len(geoms)
+    _, group = connected_components(coo_matrix((np.ones(len(a)), (a, b)), shape=(n, n)), directed=False)
+    size = np.bincount(group)
+    alone = size[group] == 1
+    order = np.argsort(group[~alone], kind="stable")
+    grouped = geoms[~alone][order]
+    _, starts = np.unique(group[~alone][order], return_index=True)
+    merged = [shapely.union_all(g) for g in np.split(grouped, starts[1:])] if len(grouped) else []
+    return _polygons(np.concatenate([geoms[alone], np.array(merged, dtype=object)]))
+
+
+def resolve_overlaps(gdf, priority=PRIORITY, total_area=None, column="pie_cat", timings=None):
+    """Area per category with every m² counted once, as a (category, area_m2) frame.
+
+    `gdf` holds classified polygons in a metric CRS; where categories overlap, the ground
+    goes to the one listed first in `priority`. Overlapping polygons of a category are
+    dissolved (polygons that overlap nothing are left alone), then the ground higher-priority
+    categories claim is subtracted from each part through pairwise intersections with the
+    parts an STRtree finds around it. No union over all polygons and no part with holes
+    cut out is ever built. With `total_area` (e.g. the circle's), the ground not covered
+    by any category is added as an "unmapped" row.
+    """
+    t0 = time.perf_counter()
+    categories = sorted(gdf[column].unique(), key=lambda c: (priority.index(c) if c in priority else len(priority), c))
+    geoms, index = shapely.get_parts(gdf.geometry.to_numpy(), return_index=True)
+    polygonal = shapely.get_type_id(geoms) == 3
+    geoms, labels = geoms[polygonal], gdf[column].to_numpy()[index[polygonal]]
+    invalid = ~shapely.is_valid(geoms)
+    geoms[invalid] = shapely.make_valid(geoms[invalid])
+    parts, ranks = [np.array([], dtype=object)], [np.array([], dtype=int)]
+    for rank, category in enumerate(categories):
+        dissolved = _dissolve(geoms[labels == category])
+        parts.append(dissolved)
+        ranks.append(np.full(len(dissolved), rank))
+    parts, ranks = np.concatenate(parts), np.concatenate(ranks)
+
+    # free(g, r): area of g not covered by parts ranked above r. Parts of one rank are disjoint,
+    # so free(g, r) = area(g) - sum of free(g ∩ part, rank of part) over the higher-ranked parts
+    # that g meets. Expanding that breadth-first only ever intersects a shrinking piece of
+    # ground with single parts, found with the STRtree; depth is bounded by the category count.
+    tree = shapely.STRtree(parts)
+    areas = np.zeros(len(parts))
+    geoms, limit, owner, sign = parts, ranks, np.arange(len(parts)), np.ones(len(parts))
+    while len(geoms):
+        np.add.at(areas, owner, sign * shapely.area(geoms))
+        # the top category has nothing above it
+        active = limit > 0
+        geoms, limit, owner, sign = geoms[active], limit[active], owner[active], sign[active]
+        g, k = tree.query(geoms, predicate="intersects")
+        higher = ranks[k] < limit[g]
+        g, k = g[higher], k[higher]
+        # most pairs are a building inside a larger area: no overlay needed for those
+        shapely.prepare(geoms)
+        overlap = parts[k]
+        crossing = ~shapely.contains_properly(geoms[g], overlap)
+        overlap[crossing] = shapely.intersection(geoms[g[crossing]], overlap[crossing])
+        real = shapely.area(overlap) > 0  # parts touching along an edge overlap in a line
+        geoms, limit, owner, sign = overlap[real], ranks[k[real]], owner[g[real]], -sign[g[real]]
+
+    result = pd.DataFrame({column: np.asarray(categories, dtype=object)[ranks], "area_m2": areas})
+    result = result.groupby(column, sort=False)["area_m2"].sum().reset_index()
+    if total_area is not None:
+        unmapped = max(total_area - result["area_m2"].sum(), 0.0)
+        result = pd.concat([result, pd.DataFrame({column: ["unmapped"], "area_m2": [unmapped]})], ignore_index=True)
+    if timings is not None:
+        timings["overlaps"] = timings.get("overlaps", 0) + time.perf_counter() - t0
+    return result
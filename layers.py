@@ -0,0 +1,115 @@
+import html
+import json
+
+import folium
+import numpy as np
+import pandas as pd
+import shapely
+from folium.plugins import FastMarkerCluster
+
+
+def grade_layer(edges, colormap, step=0.005, precision=5, name="Street steepness"):
+    """Street grades as a single GeoJson layer.
+
+    Edges are binned by `grade_abs` into `step`-wide classes (0.5% by default) and each
+    class is merged into one MultiLineString, so the payload holds a few dozen features
+    instead of one Leaflet object per edge. Colors are looked up once per class and
+    coordinates are rounded to `precision` decimals (5 decimals is ~1 m).
+    """
+    layer = folium.FeatureGroup(name=name)
+    if edges.empty:
+        return layer
+
+    grades = edges["grade_abs"].to_numpy(dtype=float)
+    max_bin = int(np.ceil(colormap.vmax / step)) - 1
+    # grades above vmax share the top class; NaN (zero-length edges) get class -1
+    bins = np.where(np.isnan(grades), -1, np.minimum(np.floor(np.nan_to_num(grades) / step), max_bin)).astype(int)
+
+    geoms = shapely.transform(edges.geometry.to_numpy(), lambda c: np.round(c, precision))
+    order = np.argsort(bins, kind="stable")
+    classes, starts = np.unique(bins[order], return_index=True)
+    merged = shapely.multilinestrings(geoms[order], indices=np.repeat(np.arange(len(classes)), np.diff(np.append(starts, len(order)))))
+
+    features = []
+    for cls, geom in zip(classes.tolist(), merged):
+        if cls < 0:
+            color, label = "gray", "unknown"
+        else:
+            color = colormap(min((cls + 0.5) * step, colormap.vmax))
+            label = f"{cls * step:.1%}–{(cls + 1) * step:.1%}" if cls < max_bin else f"≥ {cls * step:.1%}"
+        features.append({
+            "type": "Feature",
+            "geometry": shapely.geometry.mapping(geom),
+            "properties": {"grade": label, "style": {"color": color, "weight": 3, "opacity": 0.8}},
+        })
+
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        tooltip=folium.GeoJsonTooltip(fields=["grade"], aliases=["Grade"]),
+    ).add_to(layer)
+    return layer
+
+
+def poi_layer(pois, name="Points of Interest"):
+    """PoI markers as one client-side clustered layer.
+
+    `pois` are points (EPSG:4326) with Category, Multiselect, name, color and icon columns.
+    Each marker is sent as [lat, lon, style, name]; icons, colors and popup labels live
+    in a small style table that the JS callback indexes, so the payload per marker is
+    just its coordinates and name, and markers are only created by the browser.
+    """
+    icons = pois["icon"].astype(str)
+    is_fa = icons.str.startswith("fa-")
+    styles = pd.DataFrame({
+        "category": pois["Category"].astype(str).str.capitalize().map(html.escape),
+        "label": pois["Multiselect"].astype(str).map(html.escape),
+        "color": pois["color"].astype(str),
+        "icon": icons.where(~is_fa, icons.str.slice(3)),
+        "prefix": np.where(is_fa, "fa", "glyphicon"),
+    })
+    style_table = styles.drop_duplicates().reset_index(drop=True)
+    style_idx = styles.merge(style_table.reset_index(), how="left", on=list(style_table.columns))["index"].to_numpy()
+
+    data = pd.DataFrame({
+        "lat": pois.geometry.y.round(6).to_numpy(),
+        "lon": pois.geometry.x.round(6).to_numpy(),
+        "style": style_idx,
+        "name": pois["name"].fillna("Unnamed").astype(str).map(html.escape).to_numpy(),
+    })
+
+    callback = f"""
+    var styles = {json.dumps(style_table.to_dict("records"))};
+    var callback = function (row) {{
+        var s = styles[row[2]];
+        var icon = L.AwesomeMarkers.icon({{icon: s.icon, markerColor: s.color, prefix: s.prefix}});
+        var marker = L.marker(new L.LatLng(row[0], row[1]), {{icon: icon}});
+        marker.bindPopup("<div style='font-size:12px; font-family:Arial; white-space:nowrap;'><b>" + s.category + ": </b>" + s.label + "<br>" + row[3] + "</div>");
+        return marker;
+    }};"""
+    return FastMarkerCluster(data.values.tolist(), callback=callback, name=name, disableClusteringAtZoom=17)
+
+
+def isochrone_layer(polygons, minutes, travel="walk", name="Walking time", precision=5):
+    """Nested isochrones (lon/lat polygons, one per entry of `minutes`) as one GeoJson layer.
+
+    Larger areas are drawn first so the shorter walks stay visible on top of them.
+    """
+    colors = ["#1a9850", "#91cf60", "#d9ef8b", "#fee08b", "#fc8d59"]
+    features = []
+    for i in sorted(range(len(minutes)), key=lambda i: -minutes[i]):
+        geom = shapely.transform(shapely.simplify(polygons[i], 10 ** -precision), lambda c: np.round(c, precision))
+        if geom.is_empty:
+            continue
+        features.append({
+            "type": "Feature",
+            "geometry": shapely.geometry.mapping(geom),
+            "properties": {"label": f"Within {minutes[i]} min {travel}",
+                           "style": {"color": colors[i % len(colors)], "weight": 1, "fillOpacity": 0.15}},
+        })
+    layer = folium.FeatureGroup(name=name)
+    if features:
+        folium.GeoJson(
+            {"type": "FeatureCollection", "features": features},
+            tooltip=folium.GeoJsonTooltip(fields=["label"], labels=False),
+        ).add_to(layer)
+    return layer
@@ -0,0 +1,82 @@
+"""Category lookup tables compiled from `OSM features.xls`.
+
+The spreadsheet maps OSM (key, value) pairs to land-use pie categories (sheet pie_index)
+and PoI categories (sheet Multiselect). Reading it needs xlrd and takes ~100 ms per app
+process; build() writes the cleaned sheets to a small JSON artifact instead, tagged with
+a format version and the SHA-256 of the spreadsheet it came from. load() reads the
+artifact and rebuilds it only if it is missing, of another format, or older than the
+spreadsheet, so deployments without the Excel stack just ship lookups.json.
+
+    python lookups.py      # rebuild lookups.json after editing the spreadsheet
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from features import TagLookup
+
+
+SOURCE = os.environ.get("NAVIGATOR_LOOKUP_SOURCE", "OSM features.xls")
+ARTIFACT = os.environ.get("NAVIGATOR_LOOKUPS", "lookups.json")
+FORMAT = 1
+
+# sheet -> attribute columns kept next to key and value
+SHEETS = {
+    "pie_index": ["pie_cat"],
+    "Multiselect": ["Category", "Multiselect", "color", "icon"],
+}
+
+
+def _digest(path):
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def read_sheet(source, sheet, columns):
+    """Cleaned key, value and `columns` of one sheet of the spreadsheet (needs xlrd)."""
+    df = pd.read_excel(source, sheet_name=sheet)
+    # rows without a key, value or attribute classify nothing
+    df = df.dropna(subset=["key", "value", *columns])
+    df["key"] = df["key"].astype(str).str.strip()
+    df["value"] = df["value"].astype(str).str.strip()
+    return df[["key", "value", *columns]].reset_index(drop=True)
+
+
+def build(source=SOURCE, out=ARTIFACT):
+    """Compile the spreadsheet's lookup sheets into the JSON artifact; returns its content."""
+    tables = {}
+    for sheet, columns in SHEETS.items():
+        df = read_sheet(source, sheet, columns).astype(object)
+        tables[sheet] = {col: df[col].where(df[col].notna(), None).tolist() for col in df.columns}
+    artifact = {"format": FORMAT, "source": str(source), "source_sha256": _digest(source), "tables": tables}
+    Path(out).write_text(json.dumps(artifact, ensure_ascii=False, indent=1), encoding="utf-8")
+    return artifact
+
+
+def _read(path):
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+def load(path=ARTIFACT, source=SOURCE):
+    """{sheet: (table, TagLookup)} from the artifact, rebuilt first if the spreadsheet changed."""
+    artifact = _read(path)
+    stale = artifact is None or artifact.get("format") != FORMAT
+    if not stale and Path(source).exists():
+        stale = artifact.get("source_sha256") != _digest(source)
+    if stale:
+        artifact = build(source, path)
+    lookups = {}
+    for sheet, columns in SHEETS.items():
+        table = pd.DataFrame(artifact["tables"][sheet])
+        lookups[sheet] = (table, TagLookup(table, columns))
+    return lookups
+
+
+if __name__ == "__main__":
+    artifact = build()
+    print({sheet: len(table["key"]) for sheet, table in artifact["tables"].items()})
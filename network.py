@@ -0,0 +1,328 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import shapely
+from scipy.spatial import Delaunay, cKDTree
+
+from elevation import add_node_elevations
+from extract import extract_for
+
+
+# Walk graphs (with node elevations and edge grades) memoized per location.
+# Keys are the rounded center (~10 m); each entry holds the radius it was fetched for,
+# so a smaller radius at the same place is cut out of the larger cached graph.
+_graph_cache = OrderedDict()
+_graph_cache_lock = threading.Lock()
+max_cached_graphs = 8
+
+
+def _graph_key(lat, lon):
+    return (round(lat, 4), round(lon, 4))
+
+
+def _cached_graph(lat, lon, dist):
+    with _graph_cache_lock:
+        key = _graph_key(lat, lon)
+        entry = _graph_cache.get(key)
+        if entry is None or entry[0] < dist:
+            return None
+        _graph_cache.move_to_end(key)
+        return entry
+
+
+def _store_graph(lat, lon, dist, G):
+    with _graph_cache_lock:
+        key = _graph_key(lat, lon)
+        entry = _graph_cache.get(key)
+        if entry is None or entry[0] <= dist:
+            _graph_cache[key] = (dist, G)
+        _graph_cache.move_to_end(key)
+        while len(_graph_cache) > max_cached_graphs:
+            _graph_cache.popitem(last=False)
+
+
+def get_street_graph(lat, lon, dist, timings=None):
+    """Walk network around (lat, lon), possibly before elevations are added.
+
+    A cached walk graph covering the circle is returned as is; otherwise the streets are
+    downloaded (or cut from a regional extract) and returned bare, with edge lengths
+    only, for get_walk_graph to finish. Routing by distance can start on them while the
+    elevations are still being fetched. Neither kind must be modified.
+    """
+    entry = _cached_graph(lat, lon, dist)
+    if entry is not None:
+        cached_dist, G = entry
+        if cached_dist == dist:
+            return G
+        return graph_within(G, lat, lon, dist)
+
+    t0 = time.perf_counter()
+    region = extract_for(lat, lon, dist)
+    if region is not None:
+        G = region.graph_from_point(lat, lon, dist)
+    else:
+        G = ox.graph_from_point((lat, lon), dist=dist, network_type='walk')
+    if timings is not None:
+        timings["graph"] = timings.get("graph", 0) + time.perf_counter() - t0
+    return G
+
+
+def get_walk_graph(lat, lon, dist, elevation_provider=None, progress_bar=None, timings=None, streets=None, stats=None):
+    """Walk network around (lat, lon) with node `elevation`, edge `grade`/`grade_abs` and travel times.
+
+    The returned graph is shared between callers and must not be modified. Seconds spent
+    per stage of a fresh graph are added to `timings`, and the counters of its elevation
+    lookup to `stats`, which stays empty when the graph comes from the cache. `streets`
+    is what get_street_graph returned for the same circle, if it was fetched already.
+    """
+    G = streets if streets is not None else get_street_graph(lat, lon, dist, timings)
+    if G.graph.get("walk_prepared"):
+        return G
+    G = prepare_walk_graph(G.copy() if streets is not None else G, elevation_provider, progress_bar, timings, stats)
+    _store_graph(lat, lon, dist, G)
+    return G
+
+
+def prepare_walk_graph(G, elevation_provider=None, progress_bar=None, timings=None, stats=None):
+    """Add node elevations, edge grades and travel times to a freshly downloaded walk graph."""
+    t0 = time.perf_counter()
+    G = add_node_elevations(G, provider=elevation_provider, progress_bar=progress_bar, stats=stats)
+    t1 = time.perf_counter()
+    G = ox.add_edge_grades(G, add_absolute=True)
+    t2 = time.perf_counter()
+    G = add_travel_times(G)
+    t3 = time.perf_counter()
+    G.graph["walk_prepared"] = True
+    if timings is not None:
+        for stage, seconds in (("elevation", t1 - t0), ("grades", t2 - t1), ("travel times", t3 - t2)):
+            timings[stage] = timings.get(stage, 0) + seconds
+    return G
+
+
+def graph_within(G, lat, lon, dist):
+    """Part of a larger walk graph `G` within `dist` of (lat, lon), as graph_from_point would cut it."""
+    bbox = ox.utils_geo.bbox_from_point((lat, lon), dist=dist)
+    G = ox.truncate.truncate_graph_bbox(G, bbox)
+    return ox.truncate.largest_component(G)
+
+
+# Travel cost model -------------------------------------------------------------------
+# Speeds in m/s as functions of the signed grade (rise over run in the edge's direction),
+# vectorized so every edge of a graph is priced in one call.
+
+def tobler_speed(grade):
+    """Walking speed from Tobler's hiking function: 6 km/h at a 5% descent, ~5 km/h on the flat."""
+    return 6 / 3.6 * np.exp(-3.5 * np.abs(np.asarray(grade, dtype=float) + 0.05))
+
+
+# city cyclist: rider + bike mass (kg), rolling resistance, drag area (m²), sustained power (W)
+bike_mass, bike_crr, bike_cda, bike_power = 90, 0.006, 0.6, 75
+bike_max_speed = 30 / 3.6  # braking downhill
+bike_min_speed = 1.1  # pushing the bike up steep streets
+air_density = 1.225
+gravity = 9.81
+
+
+def bike_speed(grade):
+    """Cycling speed where power balances climbing, rolling and air resistance.
+
+    Solves ½ ρ CdA v³ + m g (sin θ + Crr cos θ) v = P in closed form (~18 km/h on the flat).
+    """
+    theta = np.arctan(np.asarray(grade, dtype=float))
+    a = 0.5 * air_density * bike_cda
+    p = bike_mass * gravity * (np.sin(theta) + bike_crr * np.cos(theta)) / a
+    q = -bike_power / a
+    disc = (q / 2) ** 2 + (p / 3) ** 3
+    root = np.sqrt(np.maximum(disc, 0))
+    v = np.cbrt(-q / 2 + root) + np.cbrt(-q / 2 - root)
+    # three real roots rolling down steep streets: the largest one
+    with np.errstate(invalid="ignore", divide="ignore"):
+        downhill = 2 * np.sqrt(-p / 3) * np.cos(np.arccos(np.clip(1.5 * q / p * np.sqrt(-3 / p), -1, 1)) / 3)
+    return np.clip(np.where(disc >= 0, v, downhill), bike_min_speed, bike_max_speed)
+
+
+# edge attribute (seconds) -> speed model; a new mode is one more entry
+speed_models = {"walk_time": tobler_speed, "bike_time": bike_speed}
+
+# routing modes offered in the app: edge weight, and weight units per meter on the flat
+routing_modes = {
+    "distance": ("length", 1.0),
+    "walk time": ("walk_time", 1 / float(tobler_speed(0))),
+    "bike time": ("bike_time", 1 / float(bike_speed(0))),
+}
+
+
+def add_travel_times(G):
+    """Set a travel time (s) per edge for each of `speed_models`, from `length` and `grade`."""
+    keys, length, grade = [], [], []
+    for u, v, k, d in G.edges(keys=True, data=True):
+        keys.append((u, v, k))
+        length.append(d["length"])
+        grade.append(d.get("grade", 0))
+    length = np.array(length, dtype=float)
+    grade = np.nan_to_num(np.array(grade, dtype=float))  # zero-length edges have no grade
+    for attribute, speed in speed_models.items():
+        nx.set_edge_attributes(G, dict(zip(keys, (length / speed(grade)).tolist())), attribute)
+    return G
+
+
+def shortest_path_tree(G, source, cutoff=None, weight="length"):
+    """One Dijkstra from `source`, stopped at `cutoff`: (distances, predecessors) of reached nodes."""
+    pred, dist = nx.dijkstra_predecessor_and_distance(G, source, cutoff=cutoff, weight=weight)
+    return dist, pred
+
+
+def path_from_tree(pred, target):
+    """Node path from the tree's source to `target`, read back from the predecessor map."""
+    path = [target]
+    while pred[path[-1]]:
+        path.append(pred[path[-1]][0])
+    return path[::-1]
+
+
+# KD-tree over the nodes of each graph, built on first use and dropped with the graph
+_node_indexes = weakref.WeakKeyDictionary()
+earth_radius_m = 6371009
+
+
+def _local_xy(lon, lat, lat0):
+    # equirectangular projection around lat0, accurate to well under a meter at city scale
+    lon = np.radians(np.asarray(lon, dtype=float))
+    lat = np.radians(np.asarray(lat, dtype=float))
+    return np.column_stack([lon * np.cos(np.radians(lat0)), lat]) * earth_radius_m
+
+
+def _node_index(G):
+    index = _node_indexes.get(G)
+    if index is None:
+        node_ids, xy = zip(*((n, (d["x"], d["y"])) for n, d in G.nodes(data=True)))
+        node_ids = np.array(node_ids)
+        lon, lat = np.array(xy).T
+        lat0 = lat.mean()
+        index = (cKDTree(_local_xy(lon, lat, lat0)), node_ids, lat0)
+        _node_indexes[G] = index
+    return index
+
+
+def snap_to_nodes(G, lon, lat):
+    """Nearest graph node for every (lon, lat) point, in one vectorized KD-tree query."""
+    tree, node_ids, lat0 = _node_index(G)
+    _, idx = tree.query(_local_xy(lon, lat, lat0))
+    return node_ids[idx]
+
+
+# Isochrones ---------------------------------------------------------------------------
+walk_speed = 80  # meters per minute (4.8 km/h)
+
+# street samples of each graph and their Delaunay triangulation, built on first use
+_street_samples = weakref.WeakKeyDictionary()
+
+
+def _local_lonlat(xy, lat0):
+    # inverse of _local_xy
+    x, y = np.asarray(xy, dtype=float).T / earth_radius_m
+    return np.column_stack([np.degrees(x / np.cos(np.radians(lat0))), np.degrees(y)])
+
+
+def _samples(G, step):
+    samples = _street_samples.get(G)
+    if samples is None or samples["step"] != step:
+        _, node_ids, lat0 = _node_index(G)
+        u, v, key, geoms = [], [], [], []
+        for a, b, k, d in G.edges(keys=True, data=True):
+            if a > b and G.has_edge(b, a, k):  # the walk network holds every street in both directions
+                continue
+            u.append(a)
+            v.append(b)
+            key.append(k)
+            geoms.append(d.get("geometry"))
+        u, v, geoms = np.array(u), np.array(v), np.array(geoms, dtype=object)
+        # straight streets from their nodes' coordinates, curved ones from their geometry
+        position = {n: i for i, n in enumerate(node_ids.tolist())}
+        node_lonlat = np.array([(G.nodes[n]["x"], G.nodes[n]["y"]) for n in node_ids.tolist()]).reshape(-1, 2)
+        node_xy = _local_xy(node_lonlat[:, 0], node_lonlat[:, 1], lat0)
+        ends = np.array([[position[a], position[b]] for a, b in zip(u.tolist(), v.tolist())], dtype=int).reshape(-1, 2)
+        lines = shapely.linestrings(node_xy[ends])
+        curved = np.flatnonzero(geoms != None)  # noqa: E711
+        if len(curved):
+            lonlat, index = shapely.get_coordinates(geoms[curved], return_index=True)
+            lines[curved] = shapely.linestrings(_local_xy(lonlat[:, 0], lonlat[:, 1], lat0), indices=index)
+        # points every `step` meters inside each street, located by their fraction along it
+        xy, edge = shapely.get_coordinates(shapely.segmentize(lines, step), return_index=True)
+        inner = np.ones(len(xy), dtype=bool)
+        inner[np.unique(edge, return_index=True)[1]] = False  # first point: node u
+        inner[len(xy) - 1 - np.unique(edge[::-1], return_index=True)[1]] = False  # last point: node v
+        xy, edge = xy[inner], edge[inner]
+        fraction = shapely.line_locate_point(lines[edge], shapely.points(xy), normalized=True)
+
+        points = np.vstack([node_xy, xy])
+        triangles = Delaunay(points).simplices
+        corners = points[triangles]
+        # nearly collinear samples along the hull give slivers that break the coverage union
+        a, b, c = corners[:, 0], corners[:, 1], corners[:, 2]
+        area = np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])) / 2
+        triangles, corners = triangles[area > 1e-3], corners[area > 1e-3]
+        longest = np.max(np.linalg.norm(corners - np.roll(corners, 1, axis=1), axis=2), axis=1)
+        samples = {"step": step, "lat0": lat0, "node_ids": node_ids, "u": u, "v": v, "key": key,
+                   "edge": edge, "fraction": fraction, "points": points, "triangles": triangles,
+                   "longest": longest, "weights": {}}
+        _street_samples[G] = samples
+    return samples
+
+
+def _street_weights(G, s, weight):
+    # `weight` of each sampled street from u to v and back (travel times differ with the grade)
+    if weight not in s["weights"]:
+        forward = [G.edges[a, b, k][weight] for a, b, k in zip(s["u"].tolist(), s["v"].tolist(), s["key"])]
+        backward = [G.edges[b, a, k][weight] if G.has_edge(b, a, k) else w
+                    for a, b, k, w in zip(s["u"].tolist(), s["v"].tolist(), s["key"], forward)]
+        s["weights"][weight] = (np.array(forward, dtype=float), np.array(backward, dtype=float))
+    return s["weights"][weight]
+
+
+def isochrones(G, dist, limits, weight="length", step=20, max_gap=100, buffer=20, fill_holes=10_000):
+    """Areas reachable within each of `limits`, as lon/lat polygons, from one shortest-path tree.
+
+    `dist` maps reached nodes to their network distance (the first result of
+    shortest_path_tree with the same `weight`) in the unit of `limits`. The streets are
+    sampled every `step` meters and triangulated once per graph; each sample gets its
+    network distance through the nearer end of its street. A limit's area is the union of the triangles whose
+    corners are all reached and whose sides are at most `max_gap` meters (so large
+    unreached areas stay open), grown by `buffer` meters. Triangles do not overlap, so the
+    union is a cheap coverage union. Holes smaller than `fill_holes` m² are filled.
+    """
+    s = _samples(G, step)
+    d_node = np.array([dist.get(n, np.inf) for n in s["node_ids"].tolist()])
+    du = np.array([dist.get(n, np.inf) for n in s["u"].tolist()])
+    dv = np.array([dist.get(n, np.inf) for n in s["v"].tolist()])
+    forward, backward = _street_weights(G, s, weight)
+    e, f = s["edge"], s["fraction"]
+    d_point = np.concatenate([d_node, np.minimum(du[e] + f * forward[e], dv[e] + (1 - f) * backward[e])])
+    reach = d_point[s["triangles"]].max(axis=1)
+
+    polygons = []
+    for limit in limits:
+        keep = (reach <= limit) & (s["longest"] <= max_gap)
+        if not keep.any():
+            polygons.append(shapely.Polygon())
+            continue
+        corners = s["points"][s["triangles"][keep]]
+        triangles = shapely.polygons(np.concatenate([corners, corners[:, :1]], axis=1))
+        try:
+            area = shapely.coverage_union_all(triangles)
+        except shapely.errors.GEOSException:  # a sliver left inside: the full overlay copes
+            area = shapely.union_all(triangles)
+        area = shapely.union_all([_fill_holes(p, fill_holes) for p in shapely.get_parts(area)])
+        area = shapely.buffer(area, buffer, quad_segs=4)
+        polygons.append(shapely.transform(area, lambda xy: _local_lonlat(xy, s["lat0"])))
+    return polygons
+
+
+def _fill_holes(polygon, max_area):
+    holes = [ring for ring in polygon.interiors if shapely.Polygon(ring).area >= max_area]
+    return shapely.Polygon(polygon.exterior, holes)
@@ -0,0 +1,233 @@
+"""Managed store for the HTTP responses OSMnx caches (Overpass, Nominatim).
+
+OSMnx on its own writes one JSON file per request into `cache/`, named by the SHA-1 of
+the request URL, and never cleans up. This store keeps the same keys but holds the
+responses in one SQLite database shared by all app workers:
+
+- an index with each entry's bounding box, tag filters, size and created/last-access times,
+- payloads stored once per content hash (identical responses share a blob), zlib-compressed,
+- a size and age budget enforced by evicting least recently used entries.
+
+install() routes OSMnx's cache reads and writes through the store, once per process.
+Legacy JSON files in the cache folder are still found and imported on first use.
+
+    python osm_cache.py stats
+    python osm_cache.py import      # import all legacy JSON files
+    python osm_cache.py compact     # enforce the budget and vacuum
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import osmnx as ox
+import osmnx._http
+
+
+CACHE_DB = os.environ.get("NAVIGATOR_OSM_CACHE_DB", "cache/osm_cache.sqlite")
+MAX_MB = float(os.environ.get("NAVIGATOR_OSM_CACHE_MB", 500))
+MAX_AGE_DAYS = float(os.environ.get("NAVIGATOR_OSM_CACHE_DAYS", 90))
+
+
+_POLY = re.compile(r"poly:['\"]([^'\"]+)['\"]")
+_TAG = re.compile(r"\[(['\"])([^'\"]+)\1(?:(=|!=|~|!~)(['\"])([^'\"]*)\4)?\]")
+
+
+def describe_request(url):
+    """(bbox, tags) of an Overpass request URL; bbox is (west, south, east, north) or None."""
+    query = parse_qs(urlparse(url).query).get("data", [""])[0]
+    bbox = None
+    polys = _POLY.findall(query)
+    if polys:
+        coords = [float(v) for poly in polys for v in poly.split()]
+        lats, lons = coords[0::2], coords[1::2]
+        bbox = (min(lons), min(lats), max(lons), max(lats))
+    tags = sorted({key + (op + value if op else "") for _, key, op, _, value in _TAG.findall(query)})
+    return bbox, tags
+
+
+def _payload_bbox(response_json):
+    # extent of the nodes in an Overpass response, for legacy files whose URL is unknown
+    lats = [e["lat"] for e in response_json.get("elements", []) if "lat" in e]
+    lons = [e["lon"] for e in response_json.get("elements", []) if "lon" in e]
+    return (min(lons), min(lats), max(lons), max(lats)) if lats else None
+
+
+class ResponseStore:
+    def __init__(self, path=CACHE_DB, max_bytes=MAX_MB * 2**20, max_age_days=MAX_AGE_DAYS):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript("""
+                CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, data BLOB, raw_size INTEGER, size INTEGER);
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY, digest TEXT REFERENCES blobs(digest), url TEXT,
+                    west REAL, south REAL, east REAL, north REAL, tags TEXT,
+                    created REAL, last_access REAL);
+                CREATE INDEX IF NOT EXISTS entries_access ON entries(last_access);
+                CREATE INDEX IF NOT EXISTS entries_bbox ON entries(west, south, east, north);
+            """)
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    @staticmethod
+    def key(url):
+        # same key OSMnx uses for its cache file names
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def get(self, url=None, key=None):
+        key = key or self.key(url)
+        now = time.time()
+        with self._connect() as con:
+            row = con.execute("SELECT b.data, e.created FROM entries e JOIN blobs b USING (digest) WHERE e.key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.max_age:
+                con.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            con.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, url, response_json, key=None):
+        raw = json.dumps(response_json, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        if url:
+            bbox, tags = describe_request(url)
+        else:
+            bbox, tags = (_payload_bbox(response_json) if isinstance(response_json, dict) else None), []
+        now = time.time()
+        with self._connect() as con:
+            if con.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() is None:
+                data = zlib.compress(raw, 6)
+                con.execute("INSERT INTO blobs VALUES (?, ?, ?, ?)", (digest, data, len(raw), len(data)))
+            con.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key or self.key(url), digest, url, *(bbox or (None,) * 4), json.dumps(tags), now, now))
+        self.enforce_budget()
+        return len(raw)
+
+    def find(self, bbox, tags=None):
+        """Keys of entries whose bbox covers `bbox` (west, south, east, north) and, if given, hold all `tags`."""
+        with self._connect() as con:
+            rows = con.execute("SELECT key, tags FROM entries WHERE west <= ? AND south <= ? AND east >= ? AND north >= ?", bbox).fetchall()
+        return [k for k, t in rows if not tags or set(tags) <= set(json.loads(t))]
+
+    def enforce_budget(self):
+        """Drop entries older than the age budget, then least recently used ones until under the size budget."""
+        with self._connect() as con:
+            con.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.max_age,))
+            con.execute("DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM entries)")
+            total = con.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total > self.max_bytes:
+                for key, digest in con.execute("SELECT key, digest FROM entries ORDER BY last_access").fetchall():
+                    con.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    if con.execute("SELECT 1 FROM entries WHERE digest = ?", (digest,)).fetchone() is None:
+                        total -= con.execute("SELECT size FROM blobs WHERE digest = ?", (digest,)).fetchone()[0]
+                        con.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                    if total <= self.max_bytes:
+                        break
+
+    def compact(self):
+        self.enforce_budget()
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            con.execute("VACUUM")
+        finally:
+            con.close()
+
+    def import_legacy(self, folder=None, url=None):
+        """Import OSMnx JSON cache files (all of them, or just the one for `url`); returns the count.
+
+        Entries count as created at import time: file times do not survive a git checkout.
+        """
+        folder = Path(folder or ox.settings.cache_folder)
+        files = [folder / f"{self.key(url)}.json"] if url else sorted(folder.glob("*.json"))
+        n = 0
+        for f in files:
+            if f.exists():
+                self.put(url, json.loads(f.read_text(encoding="utf-8")), key=f.stem)
+                n += 1
+        return n
+
+    def stats(self):
+        with self._connect() as con:
+            entries, blobs, raw, size = con.execute(
+                "SELECT (SELECT COUNT(*) FROM entries), COUNT(*), COALESCE(SUM(raw_size), 0), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"entries": entries, "unique_payloads": blobs, "raw_bytes": raw, "stored_bytes": size}
+
+
+# responses served from the store and downloaded (with their JSON size), for the process
+traffic = {"hits": 0, "downloads": 0, "bytes_downloaded": 0}
+_lock = threading.Lock()
+_installed = None
+
+
+def _count(key, n=1):
+    with _lock:
+        traffic[key] += n
+
+
+def traffic_counts():
+    """Copy of the process-wide traffic counters; see instrument.Trace.watch."""
+    with _lock:
+        return dict(traffic)
+
+
+def install(store=None):
+    """Route OSMnx's response cache through `store` (a ResponseStore on CACHE_DB by default).
+
+    OSMnx is patched for the whole process, so the store is installed once: later calls
+    without a store return the installed one. The counts go to `traffic`.
+    """
+    global _installed
+    with _lock:
+        if store is None and _installed is not None:
+            return _installed
+        store = store or ResponseStore()
+        _installed = store
+
+    def retrieve(url):
+        if not ox.settings.use_cache:
+            return None
+        response_json = store.get(url)
+        if response_json is None and store.import_legacy(url=url):
+            response_json = store.get(url)
+        if response_json is not None:
+            _count("hits")
+        return response_json
+
+    def save(url, response_json, ok):
+        _count("downloads")
+        if ox.settings.use_cache and ok and response_json is not None and not (isinstance(response_json, dict) and "remark" in response_json):
+            _count("bytes_downloaded", store.put(url, response_json))
+
+    osmnx._http._retrieve_from_cache = retrieve
+    osmnx._http._save_to_cache = save
+    return store
+
+
+if __name__ == "__main__":
+    store = ResponseStore()
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "import":
+        print(f"imported {store.import_legacy()} files")
+    elif command == "compact":
+        store.compact()
+    print(store.stats())
@@ -0,0 +1,382 @@
+"""Headless neighborhood pipeline: what the app's Go! button computes, without Streamlit.
+
+geocode -> features -> land use -> grades -> travel costs -> nearest PoIs, as plain
+functions the app calls as well. score_batch() runs the pipeline for many addresses or
+coordinates and returns one scored row per location. Nearby locations are grouped into
+clusters whose walk graph and features are fetched once, for a region enclosing all of
+them, and each location is cut out of that region; clusters run in a process pool.
+
+    python pipeline.py addresses.txt scores.csv --radius 500 --poi supermarket school --mode "walk time"
+
+The input file has one address or "lat, lon" per line.
+"""
+import argparse
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+import numpy as np
+import osmnx as ox
+import pandas as pd
+from geopy.extra.rate_limiter import RateLimiter
+from geopy.geocoders import Nominatim
+from scipy.cluster.hierarchy import fcluster, linkage
+
+import lookups
+import osm_cache
+from features import feature_cache, melt_tags, merge_tags, select_features
+from landuse import circle_area, clip_to_circle, resolve_overlaps
+from network import get_walk_graph, graph_within, routing_modes, shortest_path_tree, path_from_tree, snap_to_nodes, walk_speed
+from tasks import TaskGraph
+
+
+# Built environment: land-use polygons and buildings, all values of each key
+LANDUSE_TAGS = {
+    'landuse': True,
+    'natural': True,
+    'leisure': True,
+    'amenity': True,
+    'building': True,
+}
+
+max_detour = 3  # nearest-PoI routing ignores walks longer than max_detour * radius
+iso_minutes = [5, 10, 15]  # travel time bands drawn around the address and used to count PoIs
+steep_grade = 0.08  # streets steeper than this are a challenge for bikes or long walks
+
+
+@lru_cache(maxsize=None)
+def category_lookups():
+    """{sheet: (table, TagLookup)} of the compiled category lookups, loaded once per process."""
+    return lookups.load()
+
+
+@lru_cache(maxsize=None)
+def _geocoder():
+    # Nominatim's usage policy allows one request per second
+    return RateLimiter(Nominatim(user_agent="Navigator").geocode, min_delay_seconds=1)
+
+
+@lru_cache(maxsize=1024)
+def geocode(address):
+    """(lat, lon) of an address, or None if Nominatim does not find it."""
+    location = _geocoder()(address)
+    return None if location is None else (location.latitude, location.longitude)
+
+
+def poi_categories():
+    """Sorted PoI category names (the Multiselect names of the lookup)."""
+    ms_index, _ = category_lookups()["Multiselect"]
+    return sorted(ms_index["Multiselect"].unique())
+
+
+def poi_filter(categories):
+    """Overpass tag filter of the PoI categories (Multiselect names of the lookup)."""
+    ms_index, _ = category_lookups()["Multiselect"]
+    return ms_index[ms_index["Multiselect"].isin(categories)][["key", "value"]].groupby("key")["value"].apply(list).to_dict()
+
+
+def landuse_areas(features, lat, lon, radius, timings=None):
+    """Land-use polygons clipped to the circle (in local UTM) and the area of each pie category.
+
+    The area frame has pie_cat, total_area_m2 and values_included; ground in the circle
+    without any mapped land use is an "unmapped" row. Seconds per stage go to `timings`.
+    """
+    _, pie_lookup = category_lookups()["pie_index"]
+    melted = melt_tags(select_features(features, LANDUSE_TAGS), LANDUSE_TAGS.keys())
+    polygons = melted[melted.geometry.geom_type.isin(["Polygon", "MultiPolygon"])]
+
+    t0 = time.perf_counter()
+    polygons = pie_lookup.join(polygons)  # only polygons that are in the pie index
+    if timings is not None:
+        timings["classify"] = timings.get("classify", 0) + time.perf_counter() - t0
+
+    # clip to the circle and compute square meter areas, in one metric projection
+    polygons = clip_to_circle(polygons, lat=lat, lon=lon, radius=radius, timings=timings)
+    # every m² counted once: overlaps go to the category listed first in landuse.PRIORITY
+    areas = resolve_overlaps(polygons, total_area=circle_area(radius), timings=timings)
+    areas = areas.rename(columns={"area_m2": "total_area_m2"}).merge(
+        polygons.groupby(["pie_cat"]).agg(
+            values_included=("value", lambda x: ", ".join(sorted(x.unique())))).reset_index(),  # all values within the pie category
+        on="pie_cat", how="left")
+    areas["values_included"] = areas["values_included"].fillna("no land use mapped in OSM").str.replace("_", " ")
+    return polygons, areas
+
+
+def grade_summary(G):
+    """Length-weighted mean street grade and share of steep streets, both in %."""
+    length, grade = np.array([(d["length"], d.get("grade_abs", np.nan)) for _, _, d in G.edges(data=True)], dtype=float).reshape(-1, 2).T
+    known = ~np.isnan(grade)
+    length, grade = length[known], grade[known]
+    total = length.sum()
+    if total == 0:
+        return {"Mean grade (%)": None, "Steep streets (%)": None}
+    return {"Mean grade (%)": round(100 * (length * grade).sum() / total, 1),
+            "Steep streets (%)": round(100 * length[grade > steep_grade].sum() / total, 1)}
+
+
+def travel_costs(G, lat, lon, radius, route_mode="distance"):
+    """Shortest-path tree from the node nearest (lat, lon), weighted by the routing mode.
+
+    Returns a dict with the edge `weight`, the `limits` of iso_minutes and the detour
+    cutoff `max_cost` (all in weight units: meters or seconds), and the tree's `cost`
+    per reached node and `pred` predecessors.
+    """
+    weight, per_meter = routing_modes[route_mode]
+    home_node = snap_to_nodes(G, [lon], [lat])[0]
+    limits = [minutes * (walk_speed if weight == "length" else 60) for minutes in iso_minutes]
+    max_cost = max_detour * radius * per_meter
+    cost, pred = shortest_path_tree(G, home_node, cutoff=max(max_cost, limits[-1]), weight=weight)
+    return {"weight": weight, "limits": limits, "max_cost": max_cost, "cost": cost, "pred": pred}
+
+
+def poi_points(features, tags):
+    """PoIs matching `tags` with their lookup categories and names, as points (centroids) in EPSG:4326."""
+    _, ms_lookup = category_lookups()["Multiselect"]
+    selected = select_features(features, tags)
+    if not any(key in selected.columns for key in tags):
+        # none of the PoI keys occur in the area (features are cut from a query merged with
+        # land use): no points, and nearest_pois reports the categories as not present
+        selected = selected.assign(**{key: None for key in tags})
+    poi_data = ms_lookup.join(melt_tags(selected, tags.keys(), keep=["name"]))
+    poi_data.loc[poi_data['name'].isna(), 'name'] = "Unnamed"
+    # centroids of the polygons in a metric CRS (all at once)
+    p3857 = poi_data.to_crs(epsg=3857)
+    p3857['centroide'] = p3857.geometry.centroid
+    return p3857.set_geometry("centroide").to_crs(epsg=4326)
+
+
+def nearest_pois(G, points, categories, travel):
+    """Nearest PoI of each category by travel cost, and how many lie within each time band.
+
+    `points` come from poi_points and `travel` from travel_costs. Returns one table row
+    (a dict) per category and the route to each nearest PoI as (edges, color, tooltip).
+    """
+    weight, limits, max_cost = travel["weight"], travel["limits"], travel["max_cost"]
+    # snap all PoIs of all categories to graph nodes in one go
+    points = points.assign(node=snap_to_nodes(G, points.geometry.x, points.geometry.y))
+    points["cost"] = points["node"].map(travel["cost"])
+
+    results, routes = [], []
+    for cat in categories:
+        filtered = points[points["Multiselect"] == cat]
+        # number of PoIs within each travel time band
+        counts = {f"Within {minutes} min": int((filtered["cost"] <= limit).sum()) for minutes, limit in zip(iso_minutes, limits)}
+        empty = {"Name of nearest": None, "Distance to nearest (m)": None}
+        if weight != "length":
+            empty["Time to nearest (min)"] = None
+        if filtered.empty:
+            results.append({"Point of interest": cat, "Present": "No", **empty, **counts})
+            continue
+
+        # only PoIs reachable within max_detour * radius (in the mode's cost)
+        filtered = filtered[filtered["cost"] <= max_cost]
+        if filtered.empty:
+            results.append({"Point of interest": cat, "Present": "Yes", **empty, **counts})
+            continue
+
+        # pick nearest by the chosen mode
+        nearest = filtered.loc[filtered["cost"].idxmin()]
+        route = path_from_tree(travel["pred"], nearest["node"])
+        route_gdf = ox.routing.route_to_gdf(G, route, weight=weight) if len(route) > 1 else None
+        distance = round(route_gdf["length"].sum()) if route_gdf is not None else 0
+
+        row = {"Point of interest": cat,
+               "Present": "Yes",
+               "Name of nearest": nearest["name"],
+               "Distance to nearest (m)": distance}
+        tooltip = f"{cat}: {distance} m"
+        if weight != "length":
+            row["Time to nearest (min)"] = round(nearest["cost"] / 60, 1)
+            tooltip += f", {nearest['cost'] / 60:.0f} min"
+        results.append({**row, **counts})
+        if route_gdf is not None:
+            routes.append((route_gdf, nearest["color"], tooltip))
+    return results, routes
+
+
+def accessibility(results):
+    """0-100 score of nearest-PoI rows: 100 when every category is at the door, 0 at or beyond
+    the last time band (or unreachable), linear in between and averaged over categories."""
+    if not results:
+        return None
+    scores = []
+    for row in results:
+        minutes = row.get("Time to nearest (min)")
+        if minutes is None and row["Distance to nearest (m)"] is not None:
+            minutes = row["Distance to nearest (m)"] / walk_speed
+        scores.append(0.0 if minutes is None else max(0.0, 1 - minutes / iso_minutes[-1]))
+    return round(100 * float(np.mean(scores)), 1)
+
+
+def score_location(lat, lon, radius=500, poi=(), route_mode="distance", landuse=True, region_graph=None):
+    """One row of scores for (lat, lon): accessibility score, land-use shares, grades, nearest PoIs.
+
+    `poi` are PoI categories (Multiselect names). With `region_graph`, a walk graph that
+    encloses the circle, the streets are cut from it instead of fetched.
+    """
+    row = {"lat": lat, "lon": lon}
+    tags = poi_filter(poi) if poi else {}
+    feature_tags = merge_tags(LANDUSE_TAGS if landuse else {}, tags)
+    with TaskGraph(max_workers=1) as tasks:
+        # features are fetched next to the walk graph
+        tasks.add("features", lambda: feature_cache.get(lat, lon, feature_tags, radius) if feature_tags else None)
+        G = graph_within(region_graph, lat, lon, radius) if region_graph is not None else get_walk_graph(lat, lon, radius)
+        features = tasks.result("features")
+    if poi:
+        results, _ = nearest_pois(G, poi_points(features, tags), poi, travel_costs(G, lat, lon, radius, route_mode))
+        row["Score"] = accessibility(results)
+    if landuse:
+        _, areas = landuse_areas(features, lat, lon, radius)
+        shares = areas.groupby("pie_cat")["total_area_m2"].sum() / areas["total_area_m2"].sum()
+        row.update({f"Land use: {cat} (%)": round(100 * share, 1) for cat, share in shares.items()})
+    row.update(grade_summary(G))
+    if poi:
+        for result in results:
+            cat = result["Point of interest"]
+            row[f"{cat}: nearest (m)"] = result["Distance to nearest (m)"]
+            if "Time to nearest (min)" in result:
+                row[f"{cat}: nearest (min)"] = result["Time to nearest (min)"]
+            for minutes in iso_minutes:
+                row[f"{cat}: within {minutes} min"] = result[f"Within {minutes} min"]
+    return row
+
+
+def _local_meters(lat, lon):
+    # equirectangular x, y in meters around the mean latitude
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([lon * np.cos(lat.mean()), lat]) * 6371009
+
+
+def clusters(lat, lon, max_size):
+    """Cluster label of each location; locations in a cluster are at most `max_size` meters apart."""
+    if len(lat) < 2:
+        return np.zeros(len(lat), dtype=int)
+    return fcluster(linkage(_local_meters(lat, lon), method="complete"), t=max_size, criterion="distance") - 1
+
+
+def _region(lat, lon, radius):
+    # center and radius of a circle holding every location's circle, with a margin for
+    # bbox_from_point's latitude-dependent degree conversion
+    lat0, lon0 = (min(lat) + max(lat)) / 2, (min(lon) + max(lon)) / 2
+    xy = _local_meters(np.append(lat, lat0), np.append(lon, lon0))
+    reach = np.sqrt(((xy[:-1] - xy[-1]) ** 2).sum(axis=1)).max()
+    return lat0, lon0, (reach + radius) * 1.01 + 10
+
+
+def fetch_region(points, radius, feature_tags, progress_bar=None, timings=None):
+    """Walk graph covering the `radius` circles around all (lat, lon) `points`, fetched once.
+
+    Features matching `feature_tags` are fetched for the same region into the feature
+    cache, so each point's own feature query is then answered locally; cut each point's
+    streets out of the returned graph with network.graph_within. Seconds per stage go
+    to `timings`.
+    """
+    lat, lon = zip(*points)
+    region_lat, region_lon, reach = _region(lat, lon, radius)
+
+    def features():
+        t0 = time.perf_counter()
+        feature_cache.get(region_lat, region_lon, feature_tags, reach)
+        if timings is not None:
+            timings["features"] = timings.get("features", 0) + time.perf_counter() - t0
+
+    # the Overpass feature query runs while the graph and its elevations are fetched here,
+    # on the calling thread (the one that may update `progress_bar`)
+    with TaskGraph(max_workers=1) as tasks:
+        if feature_tags:
+            tasks.add("features", features)
+        G = get_walk_graph(region_lat, region_lon, reach, progress_bar=progress_bar, timings=timings)
+        if "features" in tasks:
+            tasks.result("features")
+    return G
+
+
+def _score_cluster(locations, radius, poi, route_mode, landuse):
+    # one pool task: the region around the cluster is fetched once (graph and features),
+    # then every location is scored from it; a failed location is reported, not raised
+    region_graph = None
+    if len(locations) > 1:
+        feature_tags = merge_tags(LANDUSE_TAGS if landuse else {}, poi_filter(poi) if poi else {})
+        try:
+            region_graph = fetch_region([(lat, lon) for _, lat, lon in locations], radius, feature_tags)
+        except Exception:
+            region_graph = None  # each location fetches its own data instead
+    rows = {}
+    for i, lat, lon in locations:
+        try:
+            rows[i] = score_location(lat, lon, radius, poi, route_mode, landuse, region_graph=region_graph)
+        except Exception as error:
+            rows[i] = {"lat": lat, "lon": lon, "error": f"{type(error).__name__}: {error}"}
+    return rows
+
+
+def score_batch(locations, radius=500, poi=(), route_mode="distance", landuse=True, workers=None, cluster_size=2000):
+    """Scored DataFrame with one row per location (an address or a (lat, lon) pair), in input order.
+
+    Addresses are geocoded first, at Nominatim's one request per second. Locations at
+    most `cluster_size` meters apart share one fetched region; clusters are scored in
+    `workers` processes (one per core by default; 1 keeps everything in this process).
+    A location that fails gets an `error` instead of stopping the batch.
+    """
+    poi = tuple(poi)
+    unknown = sorted(set(poi) - set(poi_categories()))
+    if unknown:
+        raise ValueError(f"Unknown PoI categories: {', '.join(unknown)}. Choose from: {', '.join(poi_categories())}")
+    osm_cache.install()
+    rows, points = [], []
+    for i, location in enumerate(locations):
+        if isinstance(location, str):
+            rows.append({"location": location})
+            found = geocode(location)
+            if found is None:
+                rows[-1]["error"] = "address not found"
+                continue
+        else:
+            rows.append({"location": f"{location[0]}, {location[1]}"})
+            found = tuple(location)
+        points.append((i, *found))
+
+    if points:
+        _, lat, lon = zip(*points)
+        labels = clusters(np.array(lat), np.array(lon), cluster_size)
+        tasks = [[p for p, label in zip(points, labels) if label == cluster] for cluster in np.unique(labels)]
+        score = partial(_score_cluster, radius=radius, poi=poi, route_mode=route_mode, landuse=landuse)
+        if workers == 1 or len(tasks) == 1:
+            scored = map(score, tasks)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=osm_cache.install) as pool:
+                scored = list(pool.map(score, tasks))
+        for cluster_rows in scored:
+            for i, row in cluster_rows.items():
+                rows[i].update(row)
+
+    df = pd.DataFrame(rows)
+    front = [c for c in ["location", "lat", "lon", "Score"] if c in df.columns]
+    back = ["error"] if "error" in df.columns else []
+    return df[front + [c for c in df.columns if c not in front + back] + back]
+
+
+def _parse_location(line):
+    # "lat, lon" lines are coordinates, anything else an address
+    match = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*[,;\s]\s*(-?\d+(?:\.\d+)?)\s*", line)
+    return (float(match[1]), float(match[2])) if match else line.strip()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score many addresses or coordinates without the app.")
+    parser.add_argument("locations", help="text file with one address or 'lat, lon' per line")
+    parser.add_argument("out", help="CSV file for the scores")
+    parser.add_argument("--radius", type=int, default=500, help="meters around each location")
+    parser.add_argument("--poi", nargs="*", default=[], choices=poi_categories(), metavar="CATEGORY",
+                        help="PoI categories (Multiselect names in the lookup): %(choices)s")
+    parser.add_argument("--mode", default="distance", choices=list(routing_modes), help="routing mode for nearest PoIs")
+    parser.add_argument("--no-landuse", action="store_true", help="skip the land use distribution")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    parser.add_argument("--cluster-size", type=float, default=2000, help="meters within which locations share a fetch")
+    args = parser.parse_args()
+    with open(args.locations, encoding="utf-8") as f:
+        locations = [_parse_location(line) for line in f if line.strip()]
+    scores = score_batch(locations, args.radius, args.poi, args.mode, not args.no_landuse, args.workers, args.cluster_size)
+    scores.to_csv(args.out, index=False)
+    print(scores.to_string(max_cols=8))
@@ -0,0 +1,75 @@
+"""Dependency-aware runner for the independent stages of a query.
+
+Each task is a function of the results of the tasks it depends on and starts on a
+thread pool as soon as those are done. Stages that wait on the network (Overpass, the
+elevation API) or release the GIL in GEOS and numpy overlap instead of adding up: the
+feature fetch runs next to the graph download and elevation lookup, land use is
+processed while elevations are still coming in, and so on.
+
+    with TaskGraph() as tasks:
+        tasks.add("features", fetch_features)
+        tasks.add("graph", fetch_graph)
+        tasks.add("land use", landuse_areas, "features")
+        tasks.add("routes", nearest, "graph", "features")
+        for name in tasks.as_completed():
+            ...                      # or tasks.result("routes"), in any order
+"""
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+
+
+class TaskGraph:
+    """Named tasks on a thread pool, each started once the tasks it depends on are done.
+
+    `wrap(name, fn)` may return a replacement for each task function, e.g. to time it
+    or to give its thread a Streamlit script context. A task whose dependency failed
+    fails with the same exception, raised again by result().
+    """
+
+    def __init__(self, max_workers=8, wrap=None):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="navigator-task")
+        self._wrap = wrap
+        self._futures = {}
+
+    def add(self, name, fn, *deps):
+        """Schedule `fn(*results of deps)` as task `name`; dependencies must be added first."""
+        waits = [self._futures[d] for d in deps]
+        fn = self._wrap(name, fn) if self._wrap else fn
+        # tasks are queued in the order they are added, so a task only ever waits on
+        # tasks that are already running: no deadlock however few workers there are
+        self._futures[name] = self._pool.submit(lambda: fn(*[f.result() for f in waits]))
+        return name
+
+    def add_result(self, name, result):
+        """Add task `name` as already done with `result`, e.g. one kept from an earlier run."""
+        self._futures[name] = Future()
+        self._futures[name].set_result(result)
+        return name
+
+    def __contains__(self, name):
+        return name in self._futures
+
+    def result(self, name):
+        """Result of task `name`, waiting for it if needed."""
+        return self._futures[name].result()
+
+    def as_completed(self, names=None):
+        """Names of the tasks (all, or `names`) in the order they finish."""
+        futures = {self._futures[n]: n for n in (names or self._futures)}
+        for future in as_completed(futures):
+            yield futures[future]
+
+    def wait(self, names, timeout=None):
+        """Names of the tasks among `names` that are done, waiting until there is at least one
+        (or `timeout` seconds have passed), in the order of `names`."""
+        done, _ = wait([self._futures[n] for n in names], timeout=timeout, return_when=FIRST_COMPLETED)
+        return [n for n in names if self._futures[n] in done]
+
+    def close(self):
+        # tasks not started yet are dropped, running ones are waited for
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from elevation import CachedElevation, FallbackElevation, SRTMTiles
+
+
+class Recorder:
+    # provider answering with a constant or value(lats, lons), remembering what it was asked for
+    def __init__(self, value):
+        self.value = value
+        self.asked = []
+
+    def elevations(self, lats, lons, progress_bar=None, stats=None):
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        self.asked.append((lats.tolist(), lons.tolist()))
+        if callable(self.value):
+            return np.asarray(self.value(lats, lons), dtype=float)
+        return np.full(len(lats), self.value, dtype=float)
+
+
+def plane(lats, lons):
+    # terrain a bilinear interpolation reproduces exactly, but snapping to a post does not
+    return 100 * lats + 10 * lons
+
+
+@pytest.fixture
+def dem(tmp_path):
+    # 3 x 3 samples over N59E017: 0.5° between samples, row 0 along the north edge
+    grid = np.array([[100, 200, 300],
+                     [400, 500, 600],
+                     [700, 800, -32768]], dtype=">i2")
+    grid.tofile(tmp_path / SRTMTiles.tile_name(59, 17))
+    return tmp_path
+
+
+def test_tile_name():
+    assert SRTMTiles.tile_name(59, 17) == "N59E017.hgt"
+    assert SRTMTiles.tile_name(-34, -71) == "S34W071.hgt"
+
+
+def test_samples_and_bilinear(dem):
+    tiles = SRTMTiles(dem)
+    lats = [59.0, 59.5, 59.75, 59.75]
+    lons = [17.0, 17.5, 17.25, 17.75]
+    stats = {}
+    out = tiles.elevations(lats, lons, stats=stats)
+    # SW corner and center hit samples (next to the void, which has no weight there);
+    # the others average the four samples around them
+    np.testing.assert_allclose(out, [700, 500, (100 + 200 + 400 + 500) / 4, (200 + 300 + 500 + 600) / 4])
+    assert stats == {"local_points": 4}
+
+    # 1/4 of the way across a cell: weights 3/4 and 1/4
+    np.testing.assert_allclose(tiles.elevations([59.5], [17.125]), [0.75 * 400 + 0.25 * 500])
+
+
+def test_nodata_and_missing_tiles(dem):
+    tiles = SRTMTiles(dem)
+    # next to the void sample in the SE cell, and a point in a tile that is not there
+    out = tiles.elevations([59.25, 61.5], [17.75, 17.5])
+    assert np.isnan(out).all()
+    # the cell next to it does not see the void
+    assert not np.isnan(tiles.elevations([59.25], [17.25])).any()
+
+
+def test_fallback_asks_only_for_missing_points(dem):
+    remote = Recorder(42.0)
+    provider = FallbackElevation([SRTMTiles(dem), remote])
+    lats = [59.5, 59.25, 61.5]
+    lons = [17.5, 17.75, 17.5]
+    out = provider.elevations(lats, lons)
+    np.testing.assert_allclose(out, [500, 42, 42])
+    assert remote.asked == [([59.25, 61.5], [17.75, 17.5])]
+
+
+def test_fallback_skips_providers_once_complete(dem):
+    remote = Recorder(42.0)
+    out = FallbackElevation([SRTMTiles(dem), remote]).elevations([59.5], [17.5])
+    np.testing.assert_allclose(out, [500])
+    assert remote.asked == []
+
+
+def cached(provider, tmp_path):
+    # one post per whole degree keeps the posts easy to check
+    return CachedElevation(provider, path=tmp_path / "elevation.sqlite", resolution=1.0)
+
+
+def test_cache_interpolates_four_posts(tmp_path):
+    remote = Recorder(plane)
+    out = cached(remote, tmp_path).elevations([59.25], [17.5])
+    np.testing.assert_allclose(out, plane(59.25, 17.5))
+    (lats, lons), = remote.asked
+    assert sorted(zip(np.round(lats), np.round(lons))) == [(59, 17), (59, 18), (60, 17), (60, 18)]
+
+
+def test_cache_hits_and_misses(tmp_path):
+    remote = Recorder(plane)
+    lats, lons = [59.25, 59.75], [17.5, 17.25]
+    stats = {}
+    first = cached(remote, tmp_path).elevations(lats, lons, stats=stats)
+    assert stats == {"cache_hits": 0, "cache_misses": 2}
+    assert len(remote.asked[0][0]) == 4  # both points share the same four posts
+
+    # a new instance on the same file: everything comes from the database
+    cache = cached(remote, tmp_path)
+    stats = {}
+    np.testing.assert_allclose(cache.elevations(lats, lons, stats=stats), first)
+    assert stats == {"cache_hits": 2, "cache_misses": 0}
+    assert len(remote.asked) == 1
+    assert cache.totals() == {"hits": 2, "misses": 2}
+
+
+def test_cache_does_not_store_failed_posts(tmp_path):
+    remote = Recorder(lambda lats, lons: np.where(np.round(lats) == 60, np.nan, plane(lats, lons)))
+    cache = cached(remote, tmp_path)
+    # the first point needs a failed post; the second sits on the southern posts only
+    out = cache.elevations([59.5, 59.0], [17.5, 17.5])
+    assert np.isnan(out[0])
+    np.testing.assert_allclose(out[1], plane(59.0, 17.5))
+
+    # the failed posts are asked for again, the stored ones are not
+    remote.value = plane
+    np.testing.assert_allclose(cache.elevations([59.5], [17.5]), plane(59.5, 17.5))
+    lats, lons = remote.asked[-1]
+    assert sorted(zip(np.round(lats), np.round(lons))) == [(60, 17), (60, 18)]
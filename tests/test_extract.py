@@ -0,0 +1,99 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from osmnx._errors import InsufficientResponseError
+
+import extract
+from extract import RegionalExtract, extract_for, ingest
+
+SAMPLE = Path(__file__).parent / "data" / "sample.osm"
+CENTER = (59.330, 18.060)
+
+
+def ingest_with(reader, source, out):
+    # the pyosmium stream, or OSMnx's XML parser as used when pyosmium is not installed
+    if reader == "osmium":
+        pytest.importorskip("osmium")
+        return ingest(source, out)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setitem(sys.modules, "osmium", None)
+        return ingest(source, out)
+
+
+@pytest.fixture(scope="module", params=["osmium", "xml"])
+def region(request, tmp_path_factory):
+    out = tmp_path_factory.mktemp(request.param)
+    ingest_with(request.param, SAMPLE, out)
+    return RegionalExtract(out)
+
+
+def test_ingest(region):
+    meta = json.loads((region.directory / "meta.json").read_text())
+    assert meta["features"] == 4
+    assert meta["nodes"] == len(region.graph)
+    assert meta["keys"] == extract.FEATURE_KEYS
+    # the motorway is not part of the walk network and does not widen the bounds
+    assert 10 not in region.graph and 11 not in region.graph
+    assert meta["bounds"][2] < 18.062
+
+
+def test_covers(region):
+    assert region.covers(*CENTER, 50)
+    assert region.covers(*CENTER, 50, tags={"shop": True, "amenity": True})
+    assert not region.covers(*CENTER, 5000)
+    assert not region.covers(*CENTER, 50, tags={"highway": True})
+
+
+def test_features_from_point(region):
+    shops = region.features_from_point(*CENTER, {"shop": "supermarket"}, 200)
+    assert shops["name"].tolist() == ["Sample Market"]
+    found = region.features_from_point(*CENTER, {"leisure": True, "amenity": "cafe"}, 200)
+    assert sorted(found["name"]) == ["Sample Cafe", "Sample Park"]
+    homes = region.features_from_point(*CENTER, {"landuse": "residential"}, 200)
+    assert homes.index.tolist() == [("relation", 301)]
+    assert homes.geometry.iloc[0].geom_type == "Polygon"
+    with pytest.raises(InsufficientResponseError):
+        region.features_from_point(*CENTER, {"railway": True}, 200)
+
+
+def test_graph_from_point(region):
+    G = region.graph_from_point(*CENTER, 200)
+    # the grid simplifies to its two T junctions joined by three streets, both directions
+    assert set(G.nodes) == {4, 6}
+    assert G.number_of_edges() == 6
+    middle = min(d["length"] for _, _, d in G.edges(data=True))
+    assert middle == pytest.approx(113.4, abs=0.5)
+    with pytest.raises(InsufficientResponseError):
+        region.graph_from_point(59.40, 18.20, 100)
+
+
+def test_extract_for(region, monkeypatch):
+    monkeypatch.setenv("NAVIGATOR_EXTRACT", str(region.directory))
+    extract._load.cache_clear()
+    assert extract_for(*CENTER, 50) is not None
+    assert extract_for(*CENTER, 5000) is None
+    monkeypatch.delenv("NAVIGATOR_EXTRACT")
+    assert extract_for(*CENTER, 50) is None
+
+
+def test_pbf_matches_xml(tmp_path):
+    osmium = pytest.importorskip("osmium")
+    pbf = tmp_path / "sample.osm.pbf"
+    with osmium.SimpleWriter(str(pbf)) as writer:
+        for obj in osmium.FileProcessor(str(SAMPLE)):
+            writer.add(obj)
+    from_pbf = ingest(pbf, tmp_path / "pbf")
+    from_xml = ingest_with("xml", SAMPLE, tmp_path / "xml")
+    for key in ["bounds", "features", "nodes", "edges"]:
+        assert from_pbf[key] == pytest.approx(from_xml[key])
+    pbf_region, xml_region = RegionalExtract(tmp_path / "pbf"), RegionalExtract(tmp_path / "xml")
+    assert sorted(pbf_region.features.index) == sorted(xml_region.features.index)
+    assert sorted(pbf_region.graph.edges) == sorted(xml_region.graph.edges)
+
+
+def test_pbf_needs_pyosmium(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "osmium", None)
+    with pytest.raises(ImportError, match="pyosmium"):
+        ingest(tmp_path / "region.osm.pbf", tmp_path / "out")